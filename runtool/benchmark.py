@@ -0,0 +1,286 @@
+#   Intel(R) Single Event API
+#
+#   This file is provided under the BSD 3-Clause license.
+#   Copyright (c) 2021, Intel Corporation
+#   All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#       Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#       Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#       Neither the name of the Intel Corporation nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#   IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# ********************************************************************************************************************************************************************************************************************************************************************************************
+
+# Usage: python benchmark.py <name> [<name> ...], see BENCHMARKS below for the names
+
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import struct
+import tempfile
+
+if __name__ == "__main__":
+    sys.path.append(os.path.realpath(os.path.dirname(__file__)))
+
+import sea  # resolves the circular import of sea_runtool
+import sea_runtool
+from sea_runtool import parse_args, reset_global, default_tree, Progress
+
+
+def write_collection(root, pid, threads, events, strings=16):
+    """Writes synthetic .sea collection folder: nested tasks and counters on every thread."""
+    folder = os.path.join(root, 'pid-%d' % pid)
+    os.makedirs(os.path.join(folder, 'bench'))
+    with open(os.path.join(folder, 'process.dct'), 'w') as file:
+        file.write(str({'bits': 64, 'time_freq': 1000000000}))
+    for handle in range(1, strings + 1):
+        with open(os.path.join(folder, '%d.str' % handle), 'w') as file:
+            file.write('task_%d' % handle)
+    for tid in range(1, threads + 1):
+        with open(os.path.join(folder, 'bench', '%d.sea' % tid), 'wb') as file:
+            stamp = 1000 + tid
+            for i in range(events // 4):
+                handle = 1 + i % strings
+                file.write(struct.pack('=QbbQ', stamp, 0, 0x4, handle))  # task_begin with string
+                file.write(struct.pack('=QbbQd', stamp + 100, 6, 0x4 | 0x20, handle, float(i)))  # counter
+                file.write(struct.pack('=Qbb', stamp + 200, 1, 0))  # task_end
+                file.write(struct.pack('=QbbQQ5s', stamp + 300, 5, 0x4 | 0x10, handle, 5, b'track'))  # marker
+                stamp += threads * 1000
+    return folder
+
+
+def transform_collection(folder, formats=('stat',), extra=()):
+    args, _ = parse_args(['-i', folder, '-f'] + list(formats) + ['-v', 'error'] + list(extra))
+    reset_global('arguments', args)
+    args.user_input = folder
+    start = time.time()
+    sea_runtool.transform(args)
+    return time.time() - start
+
+
+def bench_merge(thread_counts=(1, 4, 16, 64, 256), events=200000):
+    """transform2 throughput against the count of per thread .sea files for the same amount of events."""
+    print('%10s %10s %12s' % ('threads', 'seconds', 'events/s'))
+    for threads in thread_counts:
+        root = tempfile.mkdtemp()
+        try:
+            folder = write_collection(root, 1, threads, events // threads)
+            elapsed = transform_collection(folder)
+            print('%10d %10.2f %12d' % (threads, elapsed, events / elapsed))
+        finally:
+            shutil.rmtree(root)
+
+
+def bench_modules(module_counts=(100, 1000, 5000, 20000), lookups=200000):
+    """get_module_by_ptr lookups against the count of loaded modules, half of the pointers fall between modules."""
+    print('%10s %10s %10s %12s' % ('modules', 'index', 'seconds', 'lookups/s'))
+    for count in module_counts:
+        tree = {'modules': dict((0x10000000 + i * 0x20000, ['/lib/module_%d.so' % i, str(0x10000)]) for i in range(count))}
+        start = time.time()
+        sea_runtool.get_module_index(tree)
+        built = time.time() - start
+        ptrs = [0x10000000 + (i * 7919 % (count * 0x20000)) for i in range(lookups)]
+        start = time.time()
+        found = sum(1 for ptr in ptrs if sea_runtool.get_module_by_ptr(tree, ptr)[0] is not None)
+        elapsed = time.time() - start
+        assert found
+        print('%10d %10.4f %10.2f %12d' % (count, built, elapsed, lookups / elapsed))
+
+
+class DispatchSink(sea_runtool.Callbacks):
+    """Callbacks without exporters and filters: all the time goes to TaskCombinerCommon."""
+    completed = 0
+
+    def complete_task(self, type, begin, end):
+        self.completed += 1
+
+    def relation(self, data, head, tail):
+        self.completed += 1
+
+    def global_metadata(self, data):
+        pass
+
+
+def make_sink(root, extra=()):
+    """DispatchSink of the empty collection folder, with the arguments as the command line would give."""
+    args, _ = parse_args(['-i', root, '-v', 'error'] + list(extra))
+    reset_global('arguments', args)
+    (args.user_input, args.format) = (root, [])
+    tree = default_tree(args)
+    tree['pid'] = 1
+    return DispatchSink(args, tree)
+
+
+def make_events(start, count, threads=16, domains=('bench', 'other')):
+    """Merged stream of nested, overlapped, frame and relation tasks with args, counters and markers of every thread."""
+    Record = sea_runtool.Record
+    pattern = [
+        (0, 0x1, None),  # task_begin with id
+        (4, 0x1, 'arg'),  # metadata_add to it
+        (6, 0, 'value'),  # counter
+        (0, 0, None),  # nested task_begin
+        (5, 0, 'track'),  # marker
+        (1, 0, None),  # task_end
+        (1, 0, None),  # task_end
+        (2, 0x1, None),  # task_begin_overlapped
+        (7, 0x1, None),  # frame_begin
+        (8, 0x1, None),  # frame_end
+        (12, 0x3, None),  # relation
+        (3, 0x1, None),  # task_end_overlapped
+    ]
+    events = []
+    for index in range(start, start + count):
+        (step, tid) = divmod(index, threads)
+        (cycle, position) = divmod(step, len(pattern))
+        (type, flags, name) = pattern[position]
+        record = Record(tid + 1, 1, domains[tid % len(domains)], 1000 + index * 10, type)
+        if flags & 0x1:
+            record.id = cycle + 1
+        if flags & 0x2:
+            record.parent = cycle
+        if type in (0, 2, 5, 7):
+            record.str = 'task_%d' % (cycle % 16)
+        elif name:
+            record.str = name
+            record.delta = float(cycle)
+        if type == 5:
+            record.data = name
+        events.append((sea_runtool.TaskTypes[type], record))
+    return events
+
+
+def bench_dispatch(events=10000000, chunk=100000):
+    """TaskCombinerCommon.__call__ throughput on a synthetic stream, the records are made out of the timer."""
+    root = tempfile.mkdtemp()
+    try:
+        sink = make_sink(root)
+        elapsed = 0
+        for start in range(0, events, chunk):
+            batch = make_events(start, min(chunk, events - start))
+            begin = time.time()
+            for fn, record in batch:
+                sink(fn, record)
+            elapsed += time.time() - begin
+        print('%10s %10s %12s %10s' % ('events', 'seconds', 'events/s', 'completed'))
+        print('%10d %10.2f %12d %10d' % (events, elapsed, events / elapsed, sink.completed))
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_memory(depths=(10, 100, 1000), history=10000, events=20000):
+    """Memory counters attributed to the open tasks of a thread against the nesting depth, after the thread had closed `history` overlapped tasks."""
+    Record = sea_runtool.Record
+    print('%10s %10s %10s %12s' % ('depth', 'history', 'seconds', 'events/s'))
+    root = tempfile.mkdtemp()
+    try:
+        for depth in depths:
+            sink = make_sink(root, ['--memory', 'detailed'])
+            for id in range(history):
+                sink('task_begin_overlapped', Record(1, 1, 'other', 1000 + id, 2, id=id + depth, str='done'))
+                sink('task_end_overlapped', Record(1, 1, 'other', 1001 + id, 3, id=id + depth))
+            for level in range(depth):  # half of the tasks are overlapped ones of another domain
+                record = Record(1, 1, ('bench', 'other')[level % 2], 2000 + history + level, 2 * (level % 2), str='task_%d' % level)
+                if level % 2:
+                    record.id = level
+                sink(sea_runtool.TaskTypes[record.type], record)
+            batch = [Record(1, 1, 'Memory', 2000 + history + depth + i, 6, str='CRT:Memory:Size<%d>' % (16 << (i % 4)), delta=float(i // 4)) for i in range(events)]
+            begin = time.time()
+            for record in batch:
+                sink('counter', record)
+            elapsed = time.time() - begin
+            print('%10d %10d %10.2f %12d' % (depth, history, elapsed, events / elapsed))
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_relation(thread_counts=(16, 64, 256), depth=32, events=20000):
+    """Relations to the tasks open on other threads of the domain, like GPU submit/complete pairs."""
+    Record = sea_runtool.Record
+    print('%10s %10s %10s %12s' % ('threads', 'depth', 'seconds', 'events/s'))
+    root = tempfile.mkdtemp()
+    try:
+        for threads in thread_counts:
+            sink = make_sink(root)
+            for tid in range(threads):
+                for level in range(depth):
+                    sink('task_begin', Record(tid, 1, 'bench', 1000 + level, 0, id=tid * depth + level + 1, str='submit'))
+            batch = [Record(threads, 1, 'bench', 2000 + i, 12, id=i, parent=1 + i * 7919 % (threads * depth)) for i in range(events)]
+            begin = time.time()
+            for record in batch:
+                sink('relation', record)
+            elapsed = time.time() - begin
+            assert sink.completed == events
+            print('%10d %10d %10.2f %12d' % (threads, depth, elapsed, events / elapsed))
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_filter(threads=16, events=400000):
+    """transform2 with --filter keeping a part of the records, against no filter."""
+    filters = [[], ['tid=1'], ['name=task_1$'], ['time=%d:%d' % (1000, 1000 + events // threads // 4 * threads * 1000 // 8)]]  # the last keeps the first 8th
+    print('%24s %10s %12s' % ('filter', 'seconds', 'events/s'))
+    root = tempfile.mkdtemp()
+    try:
+        folder = write_collection(root, 1, threads, events // threads)
+        for spec in filters:
+            elapsed = transform_collection(folder, extra=['--filter'] + spec if spec else [])
+            print('%24s %10.2f %12d' % (' '.join(spec) or '-', elapsed, events / elapsed))
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_domains(domains=100, events=1000000):
+    """Domain filter lookups per event: the module function, the filter held by the pipeline and Callbacks.on_event with it."""
+    names = ['domain_%d' % (i % domains) for i in range(events)]
+    print('%24s %10s %12s' % ('lookup', 'seconds', 'events/s'))
+    start = time.time()
+    for name in names:
+        sea_runtool.is_domain_enabled(name)
+    elapsed = time.time() - start
+    print('%24s %10.2f %12d' % ('is_domain_enabled', elapsed, events / elapsed))
+    is_enabled = sea_runtool.get_domain_filter().is_enabled
+    start = time.time()
+    for name in names:
+        is_enabled(name)
+    elapsed = time.time() - start
+    print('%24s %10.2f %12d' % ('DomainFilter.is_enabled', elapsed, events / elapsed))
+    root = tempfile.mkdtemp()
+    try:
+        sink = make_sink(root)
+        batch = [('marker', sea_runtool.Record(1, 1, name, 1000 + i, 5, str='tick')) for (i, name) in enumerate(names)]
+        start = time.time()
+        for fn, record in batch:
+            sink.on_event(fn, record)
+        elapsed = time.time() - start
+        assert sink.completed == events
+        print('%24s %10.2f %12d' % ('Callbacks.on_event', elapsed, events / elapsed))
+    finally:
+        shutil.rmtree(root)
+
+
+BENCHMARKS = {
+    'merge': bench_merge,
+    'modules': bench_modules,
+    'dispatch': bench_dispatch,
+    'memory': bench_memory,
+    'relation': bench_relation,
+    'filter': bench_filter,
+    'domains': bench_domains,
+}
+
+
+def main(names):
+    Progress.set_interceptor(None, verbose_mode=False)
+    for name in names or sorted(BENCHMARKS.keys()):
+        print('-= %s =-' % name)
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
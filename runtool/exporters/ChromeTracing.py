@@ -12,7 +12,7 @@ import codecs
 import tempfile
 import subprocess
 from datetime import datetime
-from sea_runtool import TaskCombiner, Progress, resolve_stack, to_hex, ProgressConst, get_importers, message
+from sea_runtool import TaskCombiner, Progress, resolve_stack, get_stack_table, DeferredSymbols, to_hex, ProgressConst, get_importers, message
 from python_compat import unicode
 
 MAX_GT_SIZE = 150 * 1024 * 1024
@@ -24,7 +24,7 @@ class GoogleTrace(TaskCombiner):
     class ContextSwitch:
         def __init__(self, parent, file_name):
             self.parent = parent
-            self.file = (parent.args.user_input + ".ftrace") if parent.args.single else os.path.join(parent.args.user_input, 'transform', os.path.basename(file_name) + ".ftrace")
+            self.file = (parent.args.user_input + ".ftrace") if parent.args.single or not os.path.isdir(parent.args.user_input) else os.path.join(parent.args.user_input, 'transform', os.path.basename(file_name) + ".ftrace")
             self.ftrace = None
 
         def init(self, time, cpu, tid, name):
@@ -77,8 +77,9 @@ class GoogleTrace(TaskCombiner):
         self.targets = []
         self.trace_number = 0
         self.counters = {}
-        self.frames = {}
+        self.frames = {}  # stack node -> frame, formatted on finish
         self.samples = []
+        self.deferred = DeferredSymbols(args, tree) if args.defer_symbols else None
         self.last_task = None
         self.metadata = {}
         self.last_relation_id = 0
@@ -379,30 +380,52 @@ class GoogleTrace(TaskCombiner):
             message('warning', 'Chrome Trace File Limit Exceeded on %d' % end['time'])
 
     def handle_stack(self, task, stack, name='stack'):
-        if not stack:
+        if stack:
+            self.handle_interned_stack(task, get_stack_table(self.tree).add(stack), stack, name)
+
+    def handle_interned_stack(self, task, stack_id, stack, name='stack'):
+        if stack_id < 0:
             return
-        parent = None
-        for frame in reversed(stack):  # going from parents to children
-            if parent is None:
-                frame_id = '%d' % frame['ptr']
-            else:
-                frame_id = '%d:%s' % (frame['ptr'], parent)
-            if frame_id not in self.frames:
-                data = {'category': os.path.basename(frame['module']), 'name': frame['str'].replace(' ', '\t')}
-                if '__file__' in frame and frame['__file__']:
-                    line = str(frame['__line__']) if '__line__' in frame else '0'
-                    data['name'] += ' %s(%s)' % (frame['__file__'].replace(' ', '\t'), line)
-                if parent is not None:
-                    data['parent'] = parent
-                self.frames[frame_id] = data
-            parent = frame_id
+        stacks = get_stack_table(self.tree)
+        node = stack_id
+        while node >= 0 and node not in self.frames:  # going from children to parents up to the known ones
+            self.frames[node] = stacks.get_frame(node)
+            node = stacks.get_parent(node)
         time = self.convert_time(task['time'])
         self.samples.append({
             'tid': task['tid'],
             'ts': round(time, 3) if GT_FLOAT_TIME else int(time),
-            'sf': frame_id, 'name': name
+            'sf': str(stack_id), 'name': name
         })
 
+    @staticmethod
+    def format_frame(frame, parent):
+        name = frame['str'] if 'str' in frame else DeferredSymbols.get_placeholder(frame['ptr'])
+        data = {'category': os.path.basename(frame.get('module', '')), 'name': name.replace(' ', '\t')}
+        if '__file__' in frame and frame['__file__']:
+            line = str(frame['__line__']) if '__line__' in frame else '0'
+            data['name'] += ' %s(%s)' % (frame['__file__'].replace(' ', '\t'), line)
+        if parent >= 0:
+            data['parent'] = str(parent)
+        return data
+
+    def drop_unresolved(self, stacks):  # returns {node: parent} of the frames left, as resolve_stack drops those without symbol
+        nodes = {}  # node -> the innermost resolved node of its stack, -1 for none
+        kept = {}  # (parent, frame id) -> node, the stacks differing by dropped frames only become one
+        for node in sorted(self.frames):  # the parent is added to the table before its children
+            parent = stacks.get_parent(node)
+            parent = nodes[parent] if parent >= 0 else -1
+            nodes[node] = kept.setdefault((parent, stacks.node_frames[node]), node) if 'str' in self.frames[node] else parent
+        samples = []
+        for sample in self.samples:
+            sample['sf'] = nodes[int(sample['sf'])]
+            if sample['sf'] >= 0:  # eager handle_stack skips the empty stacks
+                sample['sf'] = str(sample['sf'])
+                samples.append(sample)
+        self.samples = samples
+        self.frames = dict((node, self.frames[node]) for node in kept.values())
+        return dict((node, nodes[stacks.get_parent(node)] if stacks.get_parent(node) >= 0 else -1) for node in self.frames)
+
     Markers = {
         "unknown": "t",
         "global": "g",
@@ -447,7 +470,9 @@ class GoogleTrace(TaskCombiner):
                 name += to_hex(begin['parent']) + "->"
             if 'str' in begin:
                 name += begin['str'] + ":"
-            if 'pointer' in begin:
+            if 'pointer' in begin and self.deferred:  # exactly the key of "symbols", see finish
+                name = DeferredSymbols.get_placeholder(begin['pointer'])
+            elif 'pointer' in begin:
                 name += "func<" + to_hex(begin['pointer']) + ">:"
             else:
                 name = name.rstrip(":")
@@ -496,6 +521,8 @@ class GoogleTrace(TaskCombiner):
             res.append(', "args":')
             res.append(json.dumps(self.format_args(args), ensure_ascii=False))
         res.append('}')
+        if self.deferred and 'pointer' in begin:  # the task made it through the filters
+            self.deferred.add(begin['pointer'])
         return res
 
     def handle_leftovers(self):
@@ -505,6 +532,9 @@ class GoogleTrace(TaskCombiner):
                 counter['time'] += 1  # so, we repeat it on the end of the trace
                 self.complete_task("counter", counter, counter)
 
+    def flush(self):
+        self.file.flush()
+
     def remove_last(self, count):
         self.file.seek(-count, os.SEEK_END)
         self.file.truncate()
@@ -512,10 +542,21 @@ class GoogleTrace(TaskCombiner):
     def finish(self, intermediate=False):
         self.remove_last(2)  # remove trailing ,\n
         if not intermediate:
+            if self.deferred:
+                symbols = self.deferred.resolve(frame['ptr'] for frame in self.frames.values() if 'str' not in frame)
+                for frame in self.frames.values():
+                    if 'str' not in frame and frame['ptr'] in symbols:
+                        frame.update(symbols[frame['ptr']])
+                self.metadata['symbols'] = [dict((DeferredSymbols.get_placeholder(ptr), symbols[ptr]) for ptr in self.deferred.pointers if ptr in symbols)]
             if self.samples:
+                stacks = get_stack_table(self.tree)
+                if self.deferred:
+                    parents = self.drop_unresolved(stacks)
+                else:
+                    parents = dict((node, stacks.get_parent(node)) for node in self.frames)
                 self.file.write('], "stackFrames": {\n')
                 for id, frame in self.frames.items():
-                    self.file.write('"%s": %s,\n' % (id, json.dumps(frame)))
+                    self.file.write('"%s": %s,\n' % (id, json.dumps(self.format_frame(frame, parents[id]))))
                 if self.frames:  # deleting last two symbols from the file as we can't leave comma at the end due to json restrictions
                     self.remove_last(2)
                 self.file.write('\n}, "samples": [\n')
@@ -7,7 +7,7 @@ import contextlib
 
 if __name__ == "__main__":
     sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
-from sea_runtool import TaskCombiner, default_tree, Callbacks, Progress, get_decoders, parse_args, get_args
+from sea_runtool import TaskCombiner, default_tree, Callbacks, Progress, DeferredSymbols, decode_stack, get_decoders, parse_args, get_args
 from python_compat import func_code, func_globals, func_name
 
 
@@ -139,18 +139,30 @@ class SQLite(TaskCombiner):
         self.cursor.execute('CREATE TABLE relation (data JSON, head JSON, tail JSON)')
         self.cursor.execute('CREATE TABLE context_switch (time INTEGER, cpu INTEGER, prev JSON, next JSON)')
         #self.cursor.execute('CREATE TABLE stack (task, stack, name text)')
+        self.deferred = DeferredSymbols(args, tree) if args.defer_symbols else None
+        if self.deferred:  # pointer is the placeholder, the name of the task until resolved, see get_name
+            self.cursor.execute('CREATE TABLE symbols (pointer TEXT, name TEXT, module TEXT, file TEXT, line TEXT)')
 
     def get_targets(self):
         return [self.args.output + ".db"]
 
+    def to_json(self, data):
+        if isinstance(data, (bytes, bytearray, memoryview)):  # the stack, see decode_stack
+            return list(decode_stack(self.tree, data))
+        return dict(data)
+
     def complete_task(self, type, begin, end):
-        self.cursor.execute("INSERT INTO tasks VALUES(?,?,?)", (type, json.dumps(begin), json.dumps(end)))
+        if self.deferred and 'pointer' in begin:
+            self.deferred.add(begin['pointer'])
+            if 'str' not in begin:  # named by the placeholder, the key of symbols table
+                begin = dict(begin, str=DeferredSymbols.get_placeholder(begin['pointer']))
+        self.cursor.execute("INSERT INTO tasks VALUES(?,?,?)", (type, json.dumps(begin, default=self.to_json), json.dumps(end, default=self.to_json)))
 
     def global_metadata(self, data):
-        self.cursor.execute("INSERT INTO meta VALUES(?)", (json.dumps(data),))
+        self.cursor.execute("INSERT INTO meta VALUES(?)", (json.dumps(data, default=dict),))
 
     def relation(self, data, head, tail):
-        self.cursor.execute("INSERT INTO relation VALUES(?,?,?)", (json.dumps(data), json.dumps(head), json.dumps(tail)))
+        self.cursor.execute("INSERT INTO relation VALUES(?,?,?)", (json.dumps(data, default=dict), json.dumps(head, default=dict), json.dumps(tail, default=dict)))
 
     def handle_stack(self, task, stack, name='stack'):
         pass
@@ -160,6 +172,9 @@ class SQLite(TaskCombiner):
 
 
     def finish(self):
+        if self.deferred:
+            for ptr, symbol in self.deferred.resolve().items():
+                self.cursor.execute("INSERT INTO symbols VALUES(?,?,?,?,?)", (DeferredSymbols.get_placeholder(ptr), symbol['str'], symbol.get('module'), symbol.get('__file__'), symbol.get('__line__')))
         self.conn.commit()
         self.conn.close()
 
@@ -1,7 +1,7 @@
 import os
 import csv
 import shutil
-from sea_runtool import GraphCombiner
+from sea_runtool import GraphCombiner, DeferredSymbols
 
 # Supported values are "csv" and "tsv"
 FILE_EXTENSION = ".csv"
@@ -9,12 +9,31 @@ FILE_EXTENSION = ".csv"
 class Stat(GraphCombiner):
     def __init__(self, args, tree):
         GraphCombiner.__init__(self, args, tree)
+        self.deferred = DeferredSymbols(args, tree) if args.defer_symbols else None
 
     def get_targets(self):
         return [self.args.output + FILE_EXTENSION]
 
+    def complete_task(self, type, begin, end):
+        GraphCombiner.complete_task(self, type, begin, end)
+        if self.deferred and type == 'task' and 'pointer' in begin and 'str' not in begin:  # named by the placeholder
+            self.deferred.add(begin['pointer'])
+
+    def resolve_deferred(self):  # renames the tasks from placeholders to symbols, the same symbol of many pointers is summed up
+        symbols = dict((DeferredSymbols.get_placeholder(ptr), symbol) for ptr, symbol in self.deferred.resolve().items())
+        for data in self.per_domain.values():
+            tasks = data['tasks']
+            for placeholder in [name for name in tasks if name in symbols]:
+                symbol = symbols[placeholder]
+                task = tasks.setdefault(symbol['str'], {'time': []})
+                task['time'] += tasks.pop(placeholder)['time']
+                if '__file__' in symbol:
+                    task['src'] = '%s:%s' % (symbol['__file__'], symbol.get('__line__', 0))
+
     def finish(self):
         GraphCombiner.finish(self)
+        if self.deferred:
+            self.resolve_deferred()
         delim = ','
         if FILE_EXTENSION == ".tsv":
             delim = '\t'
@@ -13,9 +13,10 @@ from python_compat import basestring, unicode
 
 
 class ETWXML:
-    def __init__(self, callback, providers):
+    def __init__(self, callback, providers, accept=None):
         self.callback = callback
         self.providers = providers
+        self.accept = accept  # takes the parsed System, False skips parsing of the event data
 
     def tag_name(self, tag):
         if tag[0] == '{':
@@ -98,8 +99,10 @@ class ETWXML:
             if not system:
                 continue
             if system['provider'] in self.providers or system['provider'].upper() in self.providers:
-                if 'BinaryEventData' in children:
+                if 'BinaryEventData' in children:  # decoded by the event guid, into the domains of other providers
                     self.callback(system, children['BinaryEventData'].text, self.as_dict(children['ExtendedTracingInfo'])['EventGuid'].text)
+                elif self.accept and not self.accept(system):
+                    continue
                 else:
                     data = None
                     if 'EventData' in children:
@@ -134,6 +137,8 @@ class STDSRCReader:
 
         def receive(self, time, args):
             system = self.parse_system(time, args)
+            if self.reader.accept and not self.reader.accept(system):
+                return
             system['EventName'] = system['Task']
             data = dict((key, val) for (key, val) in args.items() if key and not key.startswith('hdr:'))
             if not data and 'hdr:EventMessage' in args and args['hdr:EventMessage']:
@@ -152,9 +157,10 @@ class STDSRCReader:
 
             self.reader.on_event(system, data, system)
 
-    def __init__(self, args, on_event, providers):
+    def __init__(self, args, on_event, providers, accept=None):
         self.on_event = on_event
         self.providers = providers
+        self.accept = accept  # as in ETWXML
         self.progress = 0.
         sea.prepare_environ(args)
 
@@ -578,6 +584,8 @@ class ETWXMLHandler(GPUQueue):
         time = self.convert_time(parse_int(time))
         if not self.callbacks.check_pid_allowed(pid) or not self.callbacks.check_time_in_limits(time):
             return
+        if self.callbacks.filter and not (self.callbacks.filter.accepts_thread(pid, tid) and self.callbacks.filter.accepts_time(time)):
+            return
         same_time = self.prev_time == time
         self.prev_time = time
         if same_time:
@@ -591,6 +599,12 @@ class ETWXMLHandler(GPUQueue):
             return
         self.callbacks.handle_stack(pid, tid, time, new_stack)
 
+    def accepts_system(self, system):  # the events of other providers may go to other domains, only Callbacks.on_event filters them
+        provider = system['provider']
+        if not provider or provider.startswith('{') or provider.upper() == 'MSNT_SYSTEMTRACE' or provider.upper() in self.decoders:
+            return True
+        return self.callbacks.filter.accepts_domain(provider)
+
     def on_event(self, system, data, info):
         static = self.static  # FIXME: move to self. notation everywhere
         if self.progress.time_to_tick():
@@ -1045,14 +1059,14 @@ class ETWXMLHandler(GPUQueue):
                 size = os.path.getsize(self.args.input)
                 with Progress(size, 50, strings.parsing_files % (os.path.basename(self.args.input), format_bytes(size))) as progress:
                     self.progress = progress
-                    etwxml = ETWXML(self.on_event, providers)
+                    etwxml = ETWXML(self.on_event, providers, self.accepts_system if self.callbacks.filter else None)
                     unhandled_providers = etwxml.parse(file)
                     self.finish()
                 message('warning', "Unhandled providers:" + str(unhandled_providers))
         elif self.args.input.endswith('.etl'):
             with Progress(1000, 50, strings.parsing_files % (os.path.basename(self.args.input), format_bytes(os.path.getsize(self.args.input)))) as progress:
                 self.progress = progress
-                reader = STDSRCReader(self.args, self.on_event, providers)
+                reader = STDSRCReader(self.args, self.on_event, providers, self.accepts_system if self.callbacks.filter else None)
                 self.file = reader
                 reader.parse(self.args.input)
                 self.finish()
@@ -12,6 +12,7 @@ class FTrace:
         self.callbacks = callbacks
         self.args = args
         self.tid_map = {}
+        self.filter = callbacks.filter
         self.decoders = []
         if hasattr(self.args, 'user_input') and os.path.isdir(self.args.user_input):
             self.tid_map = build_tid_map(self.args, self.args.user_input)
@@ -26,7 +27,11 @@ class FTrace:
         elif tid not in self.tid_map:
             self.tid_map[tid] = pid
         timestamp = int(timestamp * 1000000000)  # seconds to nanoseconds
+        if self.filter and self.filter.before_window(timestamp):
+            return
         if name in ['tracing_mark_write', '0']:
+            if self.filter and not self.filter.accepts_thread(pid, tid):  # other events may be of other threads, as sched_switch
+                return
             parts = args.split(':', 1)
             if len(parts) == 2:
                 name, args = tuple(parts)
@@ -49,7 +54,7 @@ def transform_ftrace(args, preprocess=None):
             count = 0
             with open(args.input) as file:
                 handler = FTrace(args, callbacks)
-                for line in file:
+                for line in iter(file.readline, ''):  # not 'in file', the progress needs tell()
                     count += 1
                     if line.startswith('#'):
                         continue
@@ -6,6 +6,7 @@ class PerfHandler:
     def __init__(self, args, callbacks):
         self.callbacks = callbacks
         self.args = args
+        self.filter = callbacks.filter
         self.last_record = None
         self.decoders = []
         decoders = get_decoders()
@@ -15,9 +16,14 @@ class PerfHandler:
 
     def handle_record(self, name, pid, tid, time):
         time = int(time * 1000000000)
+        if self.filter and not (self.filter.accepts_thread(pid, tid) and self.filter.accepts_time(time)):
+            self.last_record = None  # its stack isn't even split into frames
+            return
         self.last_record = locals()
 
     def handle_stack(self, stack):
+        if not self.last_record:
+            return
         unwound = []
         for frame in stack:
             parts = frame.split()
@@ -61,7 +67,7 @@ def transform_perf(args, preprocess=None):
             with open(args.input) as file:
                 handler = PerfHandler(args, callbacks)
                 read_stack = None
-                for line in file:
+                for line in iter(file.readline, ''):  # not 'in file', the progress needs tell()
                     count += 1
                     if not count % 1000:
                         progress.tick(file.tell())
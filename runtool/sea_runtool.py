@@ -21,8 +21,13 @@ import imp
 import sys
 import sea
 import copy
+import json
 import time
 import shutil
+import mmap
+import heapq
+import atexit
+import bisect
 import struct
 import signal
 import strings
@@ -35,6 +40,7 @@ import threading
 import subprocess
 from python_compat import *
 from glob import glob
+from array import array
 from datetime import datetime, timedelta
 
 sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), 'decoders')))
@@ -78,6 +84,10 @@ def reset_global(name, value):
     global_storage(None)[name] = value
 
 
+def shared_global(name, value):  # one object for __main__ and the sea_runtool imported by extensions
+    return global_storage(None).setdefault(name, value)
+
+
 def format_time(time):
     for coeff, suffix in [(10 ** 3, 'ns'), (10 ** 6, 'us'), (10 ** 9, 'ms')]:
         if time < coeff:
@@ -184,6 +194,8 @@ def parse_args(args):
     parser.add_argument("-r", "--ring", type=int, const='5', default=None, action='store', nargs='?', help='Makes trace to cycle inside ring buffer of given length in seconds')
     parser.add_argument("--time_shift", type=int, default=0)
     parser.add_argument("-l", "--limit", help='define')
+    parser.add_argument("--filter", nargs='*', help='Keeps only matching events: pid=1,2 tid=3,4 domain=<glob>,<glob> name=<regex> time=<begin>:<end> min_dur=<us>, see EventFilter')
+    parser.add_argument("--live", type=float, const=1., default=None, nargs='?', help='Converts while the target runs, records younger than given seconds wait for the next pass')
     parser.add_argument("--ssh")
     parser.add_argument("-p", "--password")
     parser.add_argument("-a", "--ask_to_stop", action="store_true", help='Waits confirmation to stop collection')
@@ -218,8 +230,15 @@ def parse_args(args):
     parser.add_argument("--greedy", action="store_true", help='Collect all children under hooked functions')
     parser.add_argument("--follow", action="store_true", help='Follow child')
     parser.add_argument("--sqlite", action="store_true", help='Use DB during transformation - experimental')
+    parser.add_argument("--symbol_cache", type=int, default=1000000, help='Count of symbols kept between runs in ~/.isea_symbols.db, 0 disables it')
+    parser.add_argument("--elf_symbols", action="store_true", help='Resolves Linux pointers to function names by ELF symbol tables, without file:line and addr2line')
+    parser.add_argument("--symbol_store", help='Folder of local copies of target modules: --ssh runs fill it, conversions symbolize by it')
+    parser.add_argument("--symbol_stats", help='Writes the symbolization counters of the run log into given JSON file')
+    parser.add_argument("--defer_symbols", action="store_true", help='Keeps pointers as placeholders, gt, db and stat symbolize only those left after filtering on finish')
+    parser.add_argument("--symbolizers", type=int, default=0, help='Count of addr2line processes per module resolving pointers in parallel, 0 for up to 4 by CPU count')
     parser.add_argument("--mtlshim", action="store_true", help='mtlshim - experimental')
     parser.add_argument("--user", action="store_true", default=sys.gettrace(), help="don't elevate")  # True under debug
+    parser.add_argument("-j", "--jobs", type=int, default=1, help='Count of worker processes converting independent processes and traces')
 
     separators = ['!', '?', '%']
     separator = None
@@ -350,6 +369,12 @@ def install():
 def main():
     if 'install' in sys.argv:
         return install()
+    if sys.argv[1:2] == ['index']:  # index <collection folder> [...]
+        return index_collection(sys.argv[2:])
+    if sys.argv[1:2] == ['pack']:  # pack <collection folder> [-o <file>.seapack] [-c zlib|lzma]
+        return pack_collection(sys.argv[2:])
+    if sys.argv[1:2] == ['unpack']:  # unpack <file>.seapack [-o <collection folder>]
+        return unpack_collection(sys.argv[2:])
     reset_global('environ', os.environ.copy())
     (args, victim) = parse_args(sys.argv[1:])  # skipping the script name
     if not args.user and victim and not sea.as_admin():
@@ -366,7 +391,7 @@ def main():
                 ensure_dir(args.output, clean=True)
             launch(args, victim)
         else:
-            ext = os.path.splitext(args.input)[1] if not os.path.isdir(args.input) else None
+            ext = os.path.splitext(args.input)[1] if not path_isdir(args.input) else None  # .seapack is the folder
             if not ext:
                 transform_all(args)
             else:
@@ -481,6 +506,12 @@ def launch_remote(args, victim):
     print('Removing temp dir...')
     remote.execute('rm -r %s' % trace)
 
+    store = get_symbol_store(args)
+    if store:
+        print('Pulling modules into symbol store...')
+        modules = dict(parse_module(filename)[1] for filename in glob(os.path.join(local_tmp, '*', 'pid-*', '*.mdl')))
+        store.pull(remote, args, modules)
+
     print('Transformation...')
     files = glob(os.path.join(local_tmp, '*', 'pid-*'))
     if not files:
@@ -646,8 +677,12 @@ def launch(args, victim):
         print("Waiting application to exit...")
         global_storage('collection')['time']['before'] = time.time()
 
+        live = get_live_transformer(args, sea_itf)
         try:
-            proc.wait()
+            if live:
+                live.follow(proc)
+            else:
+                proc.wait()
         except KeyboardInterrupt:
             print("Stopping all...")
             proc.send_signal(signal.SIGABRT)
@@ -680,9 +715,12 @@ def launch(args, victim):
             except OSError:
                 return False
 
+        live = get_live_transformer(args, sea_itf)
         try:
             while any(is_running(pid) for pid in pids):
                 time.sleep(0.5)
+                if live:
+                    live.poll(sea_itf.get_timestamp() - live.lag)
         except KeyboardInterrupt:
             pass
     else:
@@ -715,15 +753,27 @@ def launch(args, victim):
 
     save_collection(args)
     if args.format:
+        if live:
+            args.converted = live.finish()
         transform_all(args)
 
 
+def get_live_transformer(args, sea_itf):
+    if args.live is None or not args.format or not args.output:
+        return None
+    if args.ring or args.cuts and args.cuts != ['all']:
+        message('warning', '--live is not compatible with --ring and --cuts, converting after the exit')
+        return None
+    return LiveTransformer(args, sea_itf)
+
+
 def subst_env_vars(path):
     return os.path.expandvars(path) if sys.platform == 'win32' else os.path.expanduser(path)
 
 
 UserProfile = subst_env_vars('%USERPROFILE%' if sys.platform == 'win32' else '~')
 PermanentCache = os.path.join(UserProfile, '.isea_cache.dict')
+SymbolCachePath = os.path.join(UserProfile, '.isea_symbols.db')
 
 
 def save_collection(args):
@@ -740,8 +790,8 @@ def load_collection(args):
     collection_config = global_storage('collection')
     if not collection_config and args.input:
         path = os.path.join(args.input, 'collection.dict')
-        if os.path.exists(path):
-            with open(path) as config:
+        if path_exists(path):
+            with open_file(path) as config:
                 collection_config.update(eval(config.read().replace('L]', ']')))
 
     permanent = global_storage('permanent')
@@ -767,7 +817,8 @@ def ensure_dir(path, clean, statics={}):
 def transform_all(args):
     setattr(args, 'user_input', args.input)
     path = os.path.join(args.user_input, 'transform')
-    ensure_dir(path, True)
+    if os.path.isdir(args.user_input):  # the results of .seapack go next to it
+        ensure_dir(path, True)
 
     traces = set(args.trace if args.trace else [])
 
@@ -786,25 +837,28 @@ def transform_all(args):
     if not args.single:
         multi_out = []
         saved_output = args.output
-        sea_folders = [folder for folder in glob(os.path.join(args.input, 'pid-*')) if os.path.isdir(folder)]
+        sea_folders = [folder for folder in find_files(args.input, 'pid-*') if path_isdir(folder)]
+        converted = getattr(args, 'converted', {})  # by --live
+        for folder in [folder for folder in sea_folders if folder in converted]:
+            multi_out += converted[folder]
+            sea_folders.remove(folder)
+            (args.input, args.output) = (folder, saved_output + '.' + os.path.basename(folder))  # as run_jobs leaves them
         if sea_folders:
-            for folder in sea_folders:
-                args.input = folder
-                args.output = saved_output + '.' + os.path.basename(folder)
-                multi_out += transform(args)
+            jobs = [('sea', folder, saved_output + '.' + os.path.basename(folder)) for folder in sea_folders]
+            # the first transform might consume and time sync args.trace (see GoogleTrace), the rest wait for it
+            multi_out += run_jobs(args, jobs, 1 if args.trace else 0)
 
         if args.trace:
             traces = args.trace[:]
             args.trace = None
-            for trace in traces:
-                ext = os.path.splitext(trace)[1]
-                args.input = trace
-                args.output = saved_output + '.' + os.path.basename(trace)
-                multi_out += get_importers()[ext.lstrip('.')](args)
+            jobs = [('trace', trace, saved_output + '.' + os.path.basename(trace)) for trace in traces]
+            # system wide traces fill Callbacks globals (context switch bounds) used by others
+            multi_out += run_jobs(args, jobs, len([trace for trace in traces if os.path.splitext(trace)[1] in flagman]))
         output = join_gt_output(args, multi_out)
         args.output = saved_output
     else:
-        output = transform(args)
+        converted = getattr(args, 'converted', {})  # by --live
+        output = converted[args.input] if args.input in converted else transform(args)
         output = join_gt_output(args, output)
 
     replacement = ('/', '\\') if sys.platform == 'win32' else ('\\', '/')
@@ -822,6 +876,86 @@ def transform_all(args):
     return output
 
 
+def run_job(args, kind, input, output):
+    args.input = input
+    args.output = output
+    if kind == 'sea':
+        return transform(args)
+    return get_importers()[os.path.splitext(input)[1].lstrip('.')](args)
+
+
+JobStorage = ['environ', 'sea_env', 'collection', 'permanent', 'Callbacks', 'DomainFilter']  # global_storage state shared with workers
+
+
+def job_worker(job):  # runs in the worker process of run_jobs
+    (kind, input, output, args, storage, log_path) = job
+    for name, value in storage.items():
+        reset_global(name, value)
+    reset_global('arguments', args)
+    if log_path:
+        Collector.set_output(open(log_path, 'a'))
+    Progress.set_interceptor(None, verbose_mode=False)  # progress of many workers is unreadable
+    SymbolizerStats.pop()  # counted by the parent, fork copies them
+    result = run_job(args, kind, input, output)
+    close_symbolizers(report=False)
+    storage = get_job_storage()
+    storage['symbol_stats'] = SymbolizerStats.pop()  # the parent reports the sum of all jobs
+    return result, storage
+
+
+def get_job_storage():
+    storage = global_storage(None)
+    return dict((name, storage[name]) for name in JobStorage if name in storage)
+
+
+def merge_job_storage(storage):  # merges global_storage of a worker back into the current process
+    if 'Callbacks' in storage:
+        globals = Callbacks.get_globals()
+        worker = storage['Callbacks']
+        for time_stamp in worker['limits']:
+            if time_stamp is not None:
+                globals['limits'][0] = min(time_stamp, globals['limits'][0]) if globals['limits'][0] is not None else time_stamp
+                globals['limits'][1] = max(time_stamp, globals['limits'][1]) if globals['limits'][1] is not None else time_stamp
+        for name, value in worker['starts'].items():
+            globals['starts'][name] = min(value, globals['starts'].get(name, value))
+        for name, value in worker['ends'].items():
+            globals['ends'][name] = max(value, globals['ends'].get(name, value))
+        globals['dtrace']['finished'] = globals['dtrace']['finished'] or worker['dtrace']['finished']
+        globals['tid_map'].update(worker['tid_map'])
+    if 'targets' in storage.get('collection', {}):
+        global_storage('collection').setdefault('targets', storage['collection']['targets'])
+    if 'DomainFilter' in storage:
+        get_domain_filter().merge(storage['DomainFilter'])
+    if 'symbol_stats' in storage:
+        SymbolizerStats.merge(storage['symbol_stats'])
+
+
+def run_jobs(args, jobs, serial=0):  # jobs are (kind, input, output), the first 'serial' of them run in this process
+    output = []
+    for kind, input, job_output in (jobs if args.jobs < 2 else jobs[:serial]):
+        output += run_job(args, kind, input, job_output)
+    if args.jobs < 2 or len(jobs) <= serial:
+        return output
+
+    import multiprocessing
+    close_symbolizers(report=False)  # forked workers must not share the pipes of symbolizers
+    storage = get_job_storage()
+    log = global_storage('log')
+    log_path = log['file'].name if 'file' in log and hasattr(log['file'], 'name') else None
+    parallel = [(kind, input, job_output, args, storage, log_path) for kind, input, job_output in jobs[serial:]]
+    pool = multiprocessing.Pool(min(args.jobs, len(parallel)))
+    try:
+        results = pool.map(job_worker, parallel, chunksize=1)  # keeps the order of jobs
+    finally:
+        pool.close()
+        pool.join()
+    for result, job_storage in results:
+        output += result
+        merge_job_storage(job_storage)
+    (kind, args.input, args.output) = jobs[-1]  # as if they were run here one by one
+    return output
+
+
 def join_gt_output(args, output):
     db_traces = [item for item in output if os.path.splitext(item)[1] == '.db']
     if db_traces:
@@ -851,21 +985,27 @@ def split_filename(path):
     return {'dir': dir, 'name': name, 'cut': cut, 'ring':ring, 'ext': ext}
 
 
+def parse_module(filename):  # '<load address>.mdl' holds the path and the size of the module
+    with open_file(filename, 'r') as file:
+        parts = file.readline().split()
+    return int(os.path.basename(filename).replace(".mdl", "")), [' '.join(parts[0:-1]), parts[-1]]
+
+
 def default_tree(args):
     tree = {"strings": {}, "domains": {}, "threads": {}, "groups": {}, "modules": {}, "ring_buffer": False, "cuts": set()}
-    if os.path.isdir(args.input):
+    if path_isdir(args.input):
         process_dct = os.path.join(args.input, 'process.dct')
-        if not os.path.exists(process_dct):
+        if not path_exists(process_dct):
             return tree
-        with open(process_dct, 'r') as file:
+        with open_file(process_dct, 'r') as file:
             tree["process"] = eval(file.read())
         data_jit = os.path.join(args.input, 'data.jit')
-        if os.path.exists(data_jit):
+        if path_exists(data_jit):
             parse_jit(tree, data_jit)
-        for filename in glob(os.path.join(args.input, '*.mdl')):
-            with open(filename, 'r') as file:
-                parts = file.readline().split()
-                tree["modules"][int(os.path.basename(filename).replace(".mdl", ""))] = [' '.join(parts[0:-1]), parts[-1]]
+        for filename in find_files(args.input, '*.mdl'):
+            (load_addr, module) = parse_module(filename)
+            tree["modules"][load_addr] = module
+        tree['module_index'] = ModuleIndex(tree['modules'])
     return tree
 
 
@@ -873,82 +1013,186 @@ def build_tid_map(args, path):
     tid_map = {}
 
     def parse_process(src):
-        if not os.path.isdir(src):
+        if not path_isdir(src):
             return
         pid = src.rsplit('-', 1)[1]
         if not pid.isdigit():
             return
         pid = int(pid)
-        for folder in glob(os.path.join(src, '*', '*.sea')):
-            tid = int(os.path.basename(folder).split('!')[0].split('-')[0].split('.')[0])
-            tid_map[tid] = pid
+        for domain in list_dir(src)[0]:
+            for folder in find_files(os.path.join(src, domain), '*.sea'):
+                tid = int(os.path.basename(folder).split('!')[0].split('-')[0].split('.')[0])
+                tid_map[tid] = pid
         if pid not in tid_map:
             tid_map[pid] = pid
 
     if not args.single:
-        for folder in glob(os.path.join(path, '*-*')):
+        for folder in find_files(path, '*-*'):
             parse_process(folder)
     else:
         parse_process(path)
     return tid_map
 
 
-def parse_jit(tree, path):
-    if tree['process']['bits'] == 64:
-        pointer = {'code': 'Q', 'size': 8}
-    else:
-        pointer = {'code': 'I', 'size': 4}
-    addr_list = []
-    with open(path, 'rb') as file:
+class JitMap:
+    """
+    Methods of data.jit sorted by load address in flat arrays, resolve_jit bisects the starts.
+    The line tables of all methods are concatenated, lines[index]:lines[index + 1] is the slice of the method.
+    Names and files stay in the content and are decoded on resolve.
+    """
+    Names = struct.Struct('H')  # length of the name, class and file that follow the line table
+
+    def __init__(self, content):
+        self.content = content
+        self.starts = array('Q')
+        self.sizes = array('Q')
+        self.ids = array('I')
+        self.lines = array('Q', [0])  # indices of line tables
+        self.offsets = array('I')  # code offsets of line tables
+        self.numbers = array('I')  # line numbers of line tables
+        self.names = array('Q')  # positions of names, the length precedes
+        self.files = array('Q')  # positions of files, the length precedes
+
+    @classmethod
+    def parse(cls, content, bits):
+        header = struct.Struct('=IQII' if bits == 64 else '=IIII')  # method id, load address, method size, line table size
+        unpack_header, header_size = header.unpack_from, header.size
+        unpack_length = cls.Names.unpack_from
+        jit = cls(content)
+        (starts, sizes, ids, lines, offsets, numbers, names, files) = (jit.starts, jit.sizes, jit.ids, jit.lines, jit.offsets, jit.numbers, jit.names, jit.files)
         prev_addr = 0
-        while True:
-            chunk = file.read(4 + pointer['size'] + 4 + 4)
-            if not chunk:
-                break
-            method_id, load_address, method_size, table_size = struct.unpack('I' + pointer['code'] + 'I' + 'I', chunk)
-            data = {'id': method_id, 'addr': load_address, 'size': method_size, 'lines': []}
-            for i in range(table_size):
-                chunk = file.read(4 + 4)
-                offset_line = struct.unpack('II', chunk)
-                if not data['lines'] or offset_line != data['lines'][-1]:
-                    data['lines'].append(offset_line)
-            names = []
-            for i in range(3):
-                chunk = file.read(2)  # uint16_t
-                length = struct.unpack('H', chunk)[0]
-                names.append(file.read(length))
-            data['name'], data['class'], data['file'] = names
-            if load_address > prev_addr:
-                addr_list.append(data)
+        pos = 0
+        end = len(content)
+        while pos + header_size <= end:
+            (method_id, load_address, method_size, table_size) = unpack_header(content, pos)
+            pos += header_size
+            table_pos = pos
+            pos += 8 * table_size
+            name = pos
+            pos += 2 + unpack_length(content, pos)[0]
+            pos += 2 + unpack_length(content, pos)[0]  # class
+            file = pos
+            pos += 2 + unpack_length(content, pos)[0]
+            if load_address <= prev_addr:
+                prev_addr = load_address
+                continue
             prev_addr = load_address
-    if addr_list:
-        tree['jit'] = {
-            'start': addr_list[0]['addr'],
-            'end': addr_list[-1]['addr'] + addr_list[-1]['size'],
-            'data': addr_list
-        }
+            if table_size:
+                table = struct.unpack_from('%dI' % (2 * table_size), content, table_pos)  # (offset, line) pairs
+                if table_size > 1:  # skipping repeats
+                    pairs = list(zip(table[0::2], table[1::2]))
+                    pairs = [pair for i, pair in enumerate(pairs) if not i or pair != pairs[i - 1]]
+                    offsets.extend([pair[0] for pair in pairs])
+                    numbers.extend([pair[1] for pair in pairs])
+                else:
+                    offsets.append(table[0])
+                    numbers.append(table[1])
+            lines.append(len(offsets))
+            starts.append(load_address)
+            sizes.append(method_size)
+            ids.append(method_id)
+            names.append(name)
+            files.append(file)
+        return jit
+
+    def get_string(self, pos):
+        length = self.Names.unpack_from(self.content, pos)[0]
+        return self.content[pos + 2:pos + 2 + length].decode('utf-8', 'replace')
+
+    def get_range(self):
+        return self.starts[0], self.starts[-1] + self.sizes[-1]
+
+    def resolve(self, ptr):  # returns symbol dict or None
+        index = bisect.bisect_right(self.starts, ptr) - 1
+        if index < 0:
+            return None
+        offset = ptr - self.starts[index]
+        if offset > self.sizes[index]:
+            return None
+        symbol = {'module': 'jit', 'str': self.get_string(self.names[index]) or 'jit_method_%d' % self.ids[index], '__file__': self.get_string(self.files[index])}
+        (lo, hi) = (self.lines[index], self.lines[index + 1])
+        line = bisect.bisect_right(self.offsets, offset, lo, hi) - 1
+        if line >= lo:
+            symbol['__line__'] = self.numbers[line]
+        return symbol
+
+
+JitMaps = shared_global('JitMaps', {})  # (path, size, mtime) -> JitMap, each data.jit is parsed once for all transforms of the process
+
+
+def parse_jit(tree, path):
+    (pack, name) = SeaPack.split(path)
+    (file, buffer, base, size) = map_file(path)
+    try:
+        key = (path, size, os.path.getmtime(pack.path if pack else path))
+        if key not in JitMaps:
+            JitMaps[key] = JitMap.parse(buffer[base:base + size], tree['process']['bits'])
+    finally:
+        if file:
+            if size:
+                buffer.close()
+            file.close()
+    jit = JitMaps[key]
+    if jit.starts:
+        (start, end) = jit.get_range()
+        tree['jit'] = {'start': start, 'end': end, 'map': jit}
+
+
+HandlesTable = 'handles.tbl'  # all .str, .tid and .pid files of the process folder packed in one json file
+HandleKinds = {'.str': 'strings', '.tid': 'threads', '.pid': 'groups'}
+
+
+def read_handles(tree, folder, filenames, pack=True):
+    count = len([filename for filename in filenames if os.path.splitext(filename)[1] in HandleKinds])
+    path = "/".join([folder, HandlesTable])
+    if HandlesTable in filenames:
+        try:
+            with open_file(path, "r") as file:
+                table = json.load(file)
+            if table['count'] == count:  # otherwise new handles were written after packing
+                tree["strings"].update((int(handle), value) for handle, value in table['strings'].items())
+                tree["threads"].update(table['threads'])
+                tree["groups"].update(table['groups'])
+                return
+        except (IOError, ValueError, KeyError):
+            message('warning', 'Broken %s, reading handles one by one' % path)
 
+    for filename in filenames:
+        (handle, ext) = os.path.splitext(filename)
+        if ext not in HandleKinds:
+            continue
+        with open_file("/".join([folder, filename]), "r") as file:
+            if ext == ".str":  # each string_handle_create writes separate file, name is the handle, content is the value
+                tree["strings"][int(handle)] = file.readline()
+            elif ext == ".tid":  # named thread makes record: name is the handle and content is the value
+                tree["threads"][handle] = file.readline()
+            elif ext == ".pid":  # named groups (pseudo pids) makes record: group is the handle and content is the value
+                tree["groups"][handle] = file.readline()
+
+    if count and pack:  # packing for the next transforms
+        table = {'count': count, 'strings': tree["strings"], 'threads': tree["threads"], 'groups': tree["groups"]}
+        try:
+            with open(path, "w") as file:
+                json.dump(table, file)
+        except IOError as exc:
+            message('warning', "Can't write %s: %s" % (path, str(exc)))
 
-def sea_reader(args):  # reads the structure of .sea format folder into dictionary
+
+def sea_reader(args, pack=True):  # reads the structure of .sea format folder into dictionary
     folder = args.input
-    if not os.path.exists(folder):
+    if not path_exists(folder):
         print("""Error: folder "%s" doesn't exist""" % folder)
     tree = default_tree(args)
     pos = folder.rfind("-")  # pid of the process is encoded right in the name of the folder
     tree["pid"] = int(folder[pos + 1:])
     folder = folder.replace("\\", "/").rstrip("/")
-    toplevel = next(os.walk(folder))
-    for filename in toplevel[2]:
-        with open("/".join([folder, filename]), "r") as file:
-            if filename.endswith(".str"):  # each string_handle_create writes separate file, name is the handle, content is the value
-                tree["strings"][int(filename.replace(".str", ""))] = file.readline()
-            elif filename.endswith(".tid"):  # named thread makes record: name is the handle and content is the value
-                tree["threads"][filename.replace(".tid", "")] = file.readline()
-            elif filename.endswith(".pid"):  # named groups (pseudo pids) makes record: group is the handle and content is the value
-                tree["groups"][filename.replace(".pid", "")] = file.readline()
-    for domain in toplevel[1]:  # data from every domain gets recorded into separate folder which is named after the domain name
+    (domains, files) = list_dir(folder)
+    read_handles(tree, folder, files, pack and not SeaPack.split(folder)[0])  # .seapack is read only
+    for domain in domains:  # data from every domain gets recorded into separate folder which is named after the domain name
         tree["domains"][domain] = {"files": []}
-        for file in next(os.walk("/".join([folder, domain])))[2]:  # each thread of this domain has separate file with data
+        for file in list_dir("/".join([folder, domain]))[1]:  # each thread of this domain has separate file with data
+            if file.endswith(SeaIndex.Extension):  # sidecar time index, see SeaIndex
+                continue
             if not file.endswith(".sea"):
                 print("Warning: weird file found:", file)
                 continue
@@ -961,7 +1205,7 @@ def sea_reader(args):  # reads the structure of .sea format folder into dictiona
             tree["domains"][domain]["files"].append((tid, "/".join([folder, domain, file])))
 
         def time_sort(item):
-            with open(item[1], "rb") as file:
+            with open_file(item[1], "rb") as file:
                 tuple = read_chunk_header(file)
                 return tuple[0]
 
@@ -1057,27 +1301,7 @@ def transform(args):
     if args.cuts and args.cuts == ['all'] or not args.cuts:
         return transform2(args, tree)
     else:
-        result = []
-        output = args.output[:]  # deep copy
-        for current_cut in tree['cuts']:
-            if args.cuts and current_cut not in args.cuts:
-                continue
-            args.output = (output + "!" + current_cut) if current_cut else output
-            print("Cut #", current_cut if current_cut else "<None>")
-
-            def skip_fn(path):
-                filename = os.path.split(path)[1]
-                if current_cut:  # read only those having this cut name in filename
-                    if current_cut != split_filename(filename)['cut']:
-                        return True
-                else:  # reading those having not cut name in filename
-                    if "!" in filename:
-                        return True
-                return False
-
-            result += transform2(args, tree, skip_fn)
-        args.output = output
-        return result
+        return transform_cuts(args, tree, [cut for cut in tree['cuts'] if not args.cuts or cut in args.cuts])
 
 
 # FIXME: doesn't belong this file, move to Combiners or something
@@ -1092,6 +1316,183 @@ TaskTypes = [
     "object_new", "object_snapshot", "object_delete",
     "relation"
 ]
+TaskTypeIds = dict((name, type) for (type, name) in enumerate(TaskTypes))
+
+
+RecordFields = frozenset(['tid', 'pid', 'domain', 'time', 'type', 'id', 'parent', 'str', 'data', 'delta', 'pointer'])
+
+
+class Record(object):
+    """
+    Event of the conversion pipeline: the fields of .sea records are slots, None stands for an absent one.
+    The dict interface is for decoders, importers and exporters written against dict events:
+    keys out of the slots, or set to None explicitly, are kept in 'extra'.
+    """
+    __slots__ = ('tid', 'pid', 'domain', 'time', 'type', 'id', 'parent', 'str', 'data', 'delta', 'pointer', 'extra')
+
+    def __init__(self, tid=None, pid=None, domain=None, time=None, type=None, id=None, parent=None, str=None, data=None, delta=None, pointer=None, extra=None):
+        self.tid = tid
+        self.pid = pid
+        self.domain = domain
+        self.time = time
+        self.type = type
+        self.id = id
+        self.parent = parent
+        self.str = str
+        self.data = data
+        self.delta = delta
+        self.pointer = pointer
+        self.extra = extra
+
+    @staticmethod
+    def from_dict(data):
+        if data.__class__ is Record:
+            return data
+        record = Record()
+        for key, value in data.items():
+            record[key] = value
+        return record
+
+    def copy(self):
+        return Record(self.tid, self.pid, self.domain, self.time, self.type, self.id, self.parent, self.str, self.data, self.delta, self.pointer, dict(self.extra) if self.extra else None)
+
+    def __getitem__(self, key):
+        if key in RecordFields:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in RecordFields:
+            setattr(self, key, value)
+            if value is not None:
+                if self.extra and key in self.extra:
+                    del self.extra[key]
+                return
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in RecordFields and getattr(self, key) is not None:
+            setattr(self, key, None)
+        elif self.extra and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in RecordFields and getattr(self, key) is not None:
+            return True
+        return bool(self.extra) and key in self.extra
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = self[key]
+        del self[key]
+        return value
+
+    def update(self, other):
+        for key, value in other.items():
+            self[key] = value
+
+    def keys(self):
+        keys = [key for key in self.__slots__[:-1] if getattr(self, key) is not None]
+        return keys + list(self.extra.keys()) if self.extra else keys
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if other is None:
+            return False
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __bool__(self):  # events are never empty, unlike dicts it doesn't count the keys
+        return True
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class TaskState(object):
+    """Open tasks of one thread in one domain, TaskCombinerCommon makes it once per (domain, tid) and dispatches with it."""
+    __slots__ = ('domain', 'stack', 'byid', 'args', 'opened', 'ids', 'domains')
+
+    def __init__(self, domain, thread, opened, domains):
+        self.domain = domain
+        self.stack = thread['stack']
+        self.byid = thread['byid']
+        self.args = thread['args']
+        self.opened = opened  # open tasks of the thread in all domains, ordered by time
+        self.ids = domain['ids']  # id -> open tasks of the domain with this id, in order of begin
+        self.domains = domains  # all domains of the combiner, their order breaks the ties of time
+
+    def push(self, tasks, task, indexed=True):
+        tasks.append(task)
+        opened = self.opened
+        index = len(opened)
+        while index and opened[index - 1].time >= task.time:  # records come merged by time, so it rarely steps back
+            if opened[index - 1].time == task.time and self.get_rank(opened[index - 1]) <= self.get_rank(task):
+                break
+            index -= 1
+        opened.insert(index, task)
+        if indexed and task.id is not None:
+            self.ids.setdefault(task.id, []).append(task)
+
+    def pop(self, tasks, index=-1):
+        task = tasks.pop(index)
+        self.remove(self.opened, task)  # usually it is the innermost one
+        if task.id is not None:
+            same_id = self.ids.get(task.id)
+            if same_id and self.remove(same_id, task) and not same_id:
+                del self.ids[task.id]
+        return task
+
+    def get_rank(self, task):  # the order of the same time tasks: domains as created, then ids as they came, then the stack
+        byid = self.domains[task.domain]['tasks'][task.tid]['byid']
+        for (rank, tasks) in enumerate(byid.values()):
+            if any(item is task for item in tasks):
+                return list(self.domains).index(task.domain), rank
+        return list(self.domains).index(task.domain), len(byid)
+
+    @staticmethod
+    def remove(tasks, task):
+        for i in range(len(tasks) - 1, -1, -1):
+            if tasks[i] is task:
+                del tasks[i]
+                return True
+        return False
 
 
 class TaskCombinerCommon:
@@ -1106,6 +1507,9 @@ class TaskCombinerCommon:
         self.total_memory = 0
         self.prev_memory = None
         self.memcounters = {}
+        self.states = {}  # (domain, tid) -> TaskState
+        self.opened = {}  # tid -> open tasks of all domains ordered by time, see TaskState.push
+        self.handlers = [getattr(self, 'on_' + name) for name in TaskTypes]  # dispatch table indexed by record type
 
     def finish(self):
         self.handle_leftovers()
@@ -1140,190 +1544,209 @@ class TaskCombinerCommon:
                 self.flush_counters(threads, {'tid': 0, 'pid': self.tree['pid'], 'domain': domain})
 
     def __call__(self, fn, data):
-        domain = self.domains.setdefault(data['domain'], {'tasks': {}, 'counters': {}})
-        thread = domain['tasks'].setdefault(data['tid'], {'byid': {}, 'stack': [], 'args': {}})
-
-        def get_tasks(id):
-            if not id:
-                return thread['stack']
-            return thread['byid'].setdefault(id, [])
-
-        def get_task(id):
-            if id:
-                tasks = get_tasks(id)
-                if not tasks:  # they can be stacked
-                    tasks = get_tasks(None)
-                    if not tasks or ('id' not in tasks[-1]) or tasks[-1]['id'] != id:
-                        return None
-            else:
-                tasks = get_tasks(None)
-            if tasks:
-                return tasks[-1]
-            else:
-                return None
+        data = Record.from_dict(data)
+        state = self.states.get((data.domain, data.tid))
+        if state is None:
+            state = self.get_state(data.domain, data.tid)
+        index = TaskTypeIds.get(fn)
+        assert index is not None, "Unsupported type:" + str(fn)
+        self.handlers[index](fn, data, state)
+
+    def get_state(self, domain_name, tid):
+        domain = self.domains.setdefault(domain_name, {'tasks': {}, 'counters': {}, 'ids': {}})
+        thread = domain['tasks'].setdefault(tid, {'byid': {}, 'stack': [], 'args': {}})
+        state = self.states[(domain_name, tid)] = TaskState(domain, thread, self.opened.setdefault(tid, []), self.domains)
+        return state
 
-        def find_task(id):
-            for thread_stacks in domain['tasks'].values():  # look in all threads
-                if (id in thread_stacks['byid']) and thread_stacks['byid'][id]:
-                    return thread_stacks['byid'][id][-1]
-                else:
-                    for item in thread_stacks['stack']:
-                        if ('id' in item) and item['id'] == id:
-                            return item
-
-        def get_stack(tid):
-            stack = []
-            for domain in self.domains.values():
-                if tid not in domain['tasks']:
-                    continue
-                thread = domain['tasks'][tid]
-                for byid in thread['byid'].values():
-                    stack += byid
-                if thread['stack']:
-                    stack += thread['stack']
-            stack.sort(key=lambda item: item['time'])
-            return stack
-
-        def get_last_index(tasks, type):
-            if not len(tasks):
-                return None
-            index = len(tasks) - 1
-            while index > -1 and tasks[index]['type'] != type:
-                index -= 1
-            if index > -1:
-                return index
+    @staticmethod
+    def get_tasks(state, id):
+        if not id:
+            return state.stack
+        return state.byid.setdefault(id, [])
+
+    def get_task(self, state, id):
+        if id:
+            tasks = self.get_tasks(state, id)
+            if not tasks:  # they can be stacked
+                tasks = state.stack
+                if not tasks or tasks[-1].id != id:
+                    return None
+        else:
+            tasks = state.stack
+        if tasks:
+            return tasks[-1]
+        else:
             return None
 
-        if fn == "task_begin" or fn == "task_begin_overlapped":
-            if not (('str' in data) or ('pointer' in data)):
-                data['str'] = 'Unknown'
-            self.time_bounds[0] = min(self.time_bounds[0], data['time'])
-            if 'delta' in data and data['delta']:  # turbo mode, only begins are written
-                end = data.copy()
-                end['time'] = data['time'] + int(data['delta'])
-                self.time_bounds[1] = max(self.time_bounds[1], end['time'])
-                self.complete_task('task', data, end)  # for now arguments are not supported in turbo tasks. Once argument is passed, task gets converted to normal.
-            else:
-                get_tasks(None if fn == "task_begin" else data['id']).append(data)
-        elif fn == "task_end" or fn == "task_end_overlapped":
-            self.time_bounds[1] = max(self.time_bounds[1], data['time'])
-            tasks = get_tasks(None if fn == "task_end" else data['id'])
-            index = get_last_index(tasks, data['type'] - 1)
-            if index is not None:
-                item = tasks.pop(index)
-                if self.task_postprocessor:
-                    self.task_postprocessor.postprocess('task', item, data)
-                if not self.handle_special('task', item, data):
-                    if data['time'] > item['time']:
-                        self.complete_task('task', item, data)
-                    else:
-                        message('warning', 'Negative length task: %s => %s' % (str(item), str(data)))
-            else:
-                assert (self.tree["ring_buffer"] or self.tree['cuts'])
-                if 'str' in data:  # nothing to show without name
-                    self.no_begin.append(data)
-        elif fn == "frame_begin":
-            get_tasks(data['id'] if 'id' in data else None).append(data)
-        elif fn == "frame_end":
-            frames = get_tasks(data['id'] if 'id' in data else None)
-            index = get_last_index(frames, 7)
-            if index is not None:
-                item = frames.pop(index)
-                self.complete_task("frame", item, data)
-            else:
-                assert (self.tree["ring_buffer"] or self.tree['cuts'])
-        elif fn == "metadata_add":
-            if 'id' in data:
-                task = get_task(data['id'])
-                if task:
-                    args = task.setdefault('args', {})
+    @staticmethod
+    def find_task(state, id):  # look in all threads of the domain
+        tasks = state.ids.get(id)
+        if tasks:
+            return tasks[-1]
+        return None
+
+    def get_stack(self, tid):
+        return self.opened.get(tid, [])
+
+    @staticmethod
+    def get_last_index(tasks, type):
+        if not len(tasks):
+            return None
+        index = len(tasks) - 1
+        while index > -1 and tasks[index].type != type:
+            index -= 1
+        if index > -1:
+            return index
+        return None
+
+    # handlers of the dispatch table, named 'on_' + TaskTypes[type]:
+
+    def on_task_begin(self, fn, data, state):
+        if data.str is None and data.pointer is None:
+            data.str = 'Unknown'
+        self.time_bounds[0] = min(self.time_bounds[0], data.time)
+        if data.delta:  # turbo mode, only begins are written
+            end = data.copy()
+            end.time = data.time + int(data.delta)
+            self.time_bounds[1] = max(self.time_bounds[1], end.time)
+            self.complete_task('task', data, end)  # for now arguments are not supported in turbo tasks. Once argument is passed, task gets converted to normal.
+        else:
+            state.push(self.get_tasks(state, None if fn == "task_begin" else data.id), data)
+
+    on_task_begin_overlapped = on_task_begin
+
+    def on_task_end(self, fn, data, state):
+        self.time_bounds[1] = max(self.time_bounds[1], data.time)
+        tasks = self.get_tasks(state, None if fn == "task_end" else data.id)
+        index = self.get_last_index(tasks, data.type - 1)
+        if index is not None:
+            item = state.pop(tasks, index)
+            if self.task_postprocessor:
+                self.task_postprocessor.postprocess('task', item, data)
+            if not self.handle_special('task', item, data):
+                if data.time > item.time:
+                    self.complete_task('task', item, data)
                 else:
-                    args = thread['args'].setdefault(data['id'], {})
-
-                args[data['str']] = data['delta'] if 'delta' in data else represent_data(self.tree, data['str'], data['data']) if 'data' in data else '0x0'
-            else:  # global metadata
-                if not self.handle_special('meta', data, None):
-                    self.global_metadata(data)
-        elif fn == "object_snapshot":
-            if 'args' in data:
-                args = data['args'].copy()
-            else:
-                args = {'snapshot': {}}
-            if 'data' in data:
-                state = data['data']
-                for pair in state.split(","):
-                    (key, value) = tuple(pair.split("="))
-                    args['snapshot'][key] = value
-            data['args'] = args
-            self.complete_task(fn, data, data)
-        elif fn in ["marker", "counter", "object_new", "object_delete"]:
-            if fn == "marker" and data['data'] == 'task':
-                markers = get_tasks("marker_" + (data['id'] if 'id' in data else ""))
-                if markers:
-                    item = markers.pop()
-                    item['type'] = 7  # frame_begin
-                    item['domain'] += ".continuous_markers"
-                    item['time'] += 1
-                    self.complete_task("frame", item, data)
-                markers.append(data)
-            elif fn == "counter" and self.args.sampling:
-                if (data['time'] - self.prev_sample) > (int(self.args.sampling) * 1000):
-                    if not self.prev_sample:
-                        self.prev_sample = data['time']
-                    else:
-                        self.flush_counters(domain, data)
-                        self.prev_sample = data['time']
-                        domain['counters'] = {}
-                counter = domain['counters'].setdefault(data['str'], {'begin':data['time'], 'end': data['time'], 'values': []})
-                counter['values'].append(data['delta'])
-                counter['begin'] = min(counter['begin'], data['time'])
-                counter['end'] = max(counter['end'], data['time'])
+                    message('warning', 'Negative length task: %s => %s' % (str(item), str(data)))
+        else:
+            assert (self.tree["ring_buffer"] or self.tree['cuts'])
+            if data.str is not None:  # nothing to show without name
+                self.no_begin.append(data)
+
+    on_task_end_overlapped = on_task_end
+
+    def on_frame_begin(self, fn, data, state):
+        state.push(self.get_tasks(state, data.id), data)
+
+    def on_frame_end(self, fn, data, state):
+        frames = self.get_tasks(state, data.id)
+        index = self.get_last_index(frames, 7)
+        if index is not None:
+            item = state.pop(frames, index)
+            self.complete_task("frame", item, data)
+        else:
+            assert (self.tree["ring_buffer"] or self.tree['cuts'])
+
+    def on_metadata_add(self, fn, data, state):
+        if data.id is not None:
+            task = self.get_task(state, data.id)
+            if task:
+                args = task.setdefault('args', {})
             else:
-                if data['domain'] == 'Memory':
-                    size = int(data['str'].split('<')[1].split('>')[0])
-                    prev_value = 0.
-                    if size in self.memory:
-                        prev_value = self.memory[size]
-                    delta = data['delta'] - prev_value  # data['delta'] has current value of the counter
-                    self.total_memory += delta * size
-                    self.memory[size] = data['delta']
-                    stack = get_stack(data['tid'])
-                    if stack:
-                        current = stack[-1]
-                        values = current.setdefault('memory', {None: 0}).setdefault(size, [])
-                        values.append(delta)
-                        for parent in stack[:-1]:
-                            values = parent.setdefault('memory', {None: 0})
-                            values[None] += delta * size
-                    # Total memory:
-                    if not self.args.min_dur or (self.prev_memory is None) or (data['time'] - self.prev_memory['time'] > self.args.min_dur * 10000):
-                        total = data.copy()
-                        total['str'] = "CRT:Memory:Total(bytes)"
-                        total['delta'] = self.total_memory
-                        self.complete_task(fn, total, total)
-                        self.prev_memory = total
-                    if self.args.memory == "total":
-                        return
-                    if self.args.memory_limit > data['delta'] * size:
-                        return
-                    if self.args.min_dur:  # trim counters
-                        cache = self.memcounters.setdefault(data['pid'], {}).setdefault(data['tid'], {}).setdefault(data['str'], {'last': None, 'values': []})
-                        values = cache['values']
-                        self.compress_counter(cache, data)
-                        values.append(data)
-                        return
-                if ('id' in data) and (data['id'] in thread['args']):
-                    data['args'] = thread['args'][data['id']]
-                    del thread['args'][data['id']]
-                self.complete_task(fn, data, data)
-        elif fn == "relation":
-            self.relation(
-                data,
-                get_task(data['id'] if 'id' in data else None),
-                get_task(data['parent']) or find_task(data['parent'])
-            )
+                args = state.args.setdefault(data.id, {})
+
+            args[data.str] = data.delta if data.delta is not None else represent_data(self.tree, data.str, data.data) if data.data is not None else '0x0'
+        else:  # global metadata
+            if not self.handle_special('meta', data, None):
+                self.global_metadata(data)
+
+    def on_object_snapshot(self, fn, data, state):
+        if 'args' in data:
+            args = data['args'].copy()
         else:
-            assert (not "Unsupported type:" + fn)
+            args = {'snapshot': {}}
+        if data.data is not None:
+            for pair in data.data.split(","):
+                (key, value) = tuple(pair.split("="))
+                args['snapshot'][key] = value
+        data['args'] = args
+        self.complete_task(fn, data, data)
+
+    def on_marker(self, fn, data, state):
+        if data.data != 'task':
+            return self.on_object_new(fn, data, state)
+        markers = self.get_tasks(state, "marker_" + (data.id if data.id is not None else ""))
+        if markers:
+            item = state.pop(markers)
+            item.type = 7  # frame_begin
+            item.domain += ".continuous_markers"
+            item.time += 1
+            self.complete_task("frame", item, data)
+        state.push(markers, data, indexed=False)  # kept by "marker_" + id, not a relation target
+
+    def on_counter(self, fn, data, state):
+        if not self.args.sampling:
+            return self.on_object_new(fn, data, state)
+        domain = state.domain
+        if (data.time - self.prev_sample) > (int(self.args.sampling) * 1000):
+            if not self.prev_sample:
+                self.prev_sample = data.time
+            else:
+                self.flush_counters(domain, data)
+                self.prev_sample = data.time
+                domain['counters'] = {}
+        counter = domain['counters'].setdefault(data.str, {'begin': data.time, 'end': data.time, 'values': []})
+        counter['values'].append(data.delta)
+        counter['begin'] = min(counter['begin'], data.time)
+        counter['end'] = max(counter['end'], data.time)
+
+    def on_object_new(self, fn, data, state):  # also markers and counters, those of Memory domain are attributed to the tasks
+        if data.domain == 'Memory':
+            size = int(data.str.split('<')[1].split('>')[0])
+            prev_value = 0.
+            if size in self.memory:
+                prev_value = self.memory[size]
+            delta = data.delta - prev_value  # data.delta has current value of the counter
+            self.total_memory += delta * size
+            self.memory[size] = data.delta
+            stack = self.get_stack(data.tid)
+            if stack:
+                current = stack[-1]
+                values = current.setdefault('memory', {None: 0}).setdefault(size, [])
+                values.append(delta)
+                for parent in stack[:-1]:
+                    values = parent.setdefault('memory', {None: 0})
+                    values[None] += delta * size
+            # Total memory:
+            if not self.args.min_dur or (self.prev_memory is None) or (data.time - self.prev_memory.time > self.args.min_dur * 10000):
+                total = data.copy()
+                total.str = "CRT:Memory:Total(bytes)"
+                total.delta = self.total_memory
+                self.complete_task(fn, total, total)
+                self.prev_memory = total
+            if self.args.memory == "total":
+                return
+            if self.args.memory_limit > data.delta * size:
+                return
+            if self.args.min_dur:  # trim counters
+                cache = self.memcounters.setdefault(data.pid, {}).setdefault(data.tid, {}).setdefault(data.str, {'last': None, 'values': []})
+                values = cache['values']
+                self.compress_counter(cache, data)
+                values.append(data)
+                return
+        if (data.id is not None) and (data.id in state.args):
+            data['args'] = state.args[data.id]
+            del state.args[data.id]
+        self.complete_task(fn, data, data)
+
+    on_object_delete = on_object_new
+
+    def on_relation(self, fn, data, state):
+        self.relation(
+            data,
+            self.get_task(state, data.id),
+            self.get_task(state, data.parent) or self.find_task(state, data.parent)
+        )
 
     def compress_counter(self, cache, data):
         values = cache['values']
@@ -1365,6 +1788,92 @@ def default_event_filer(cls, type, begin, end):
     return type, begin, end
 
 
+class EventFilter(object):
+    """
+    Declarative filter of events, compiled once from the --filter key=value pairs:
+        pid=1,2 tid=3,4  processes and threads to keep
+        domain=gpu*,dx*  globs of the domains to keep
+        name=<regex>     searched in the names of tasks, markers, counters and objects
+        time=<b>:<e>     time window, either side is optional as in --limit
+        min_dur=<us>     shortest task to keep, in microseconds
+    Readers evaluate what they know of a record before they look its strings up or resolve its symbols,
+    Callbacks.on_event evaluates the rest. The begin of a task decides for its end.
+    """
+    Keys = ['pid', 'tid', 'domain', 'name', 'time', 'min_dur']
+    Ends = {1: 0, 3: 2, 8: 7}  # end type -> begin type
+    Begins = frozenset(Ends.values())
+    Instants = frozenset([5, 6, 9, 10, 11])  # named and not paired, readers may drop them by the name
+
+    def __init__(self, spec=None):
+        import re
+        spec = spec or {}
+        self.pids = set(int(pid) for pid in spec['pid'].split(',')) if 'pid' in spec else None
+        self.tids = set(int(tid) for tid in spec['tid'].split(',')) if 'tid' in spec else None
+        self.domains = re.compile('|'.join(fnmatch.translate(pattern) for pattern in spec['domain'].split(','))) if 'domain' in spec else None
+        self.names = re.compile(spec['name']) if 'name' in spec else None
+        self.window = Callbacks.parse_limits(spec['time']) if 'time' in spec else (None, None)
+        self.min_dur = float(spec.get('min_dur', 0)) * 1000  # in nanoseconds of the records
+        self.domain_verdicts = {}
+        self.name_verdicts = {}
+        self.opened = {}  # (domain, tid, id, begin type) -> verdicts of the begins waiting for their ends
+
+    @classmethod
+    def from_args(cls, args):
+        spec = {}
+        for pair in getattr(args, 'filter', None) or []:
+            (key, _, value) = pair.partition('=')
+            if key not in cls.Keys or not value:
+                raise ValueError('Bad --filter "%s", expected <key>=<value> with key of: %s' % (pair, ', '.join(cls.Keys)))
+            spec[key] = value
+        return cls(spec)
+
+    def __bool__(self):
+        return self.pids is not None or self.tids is not None or self.domains is not None or self.names is not None or self.window != (None, None) or bool(self.min_dur)
+
+    __nonzero__ = __bool__
+
+    def accepts_thread(self, pid, tid):
+        return (self.pids is None or pid in self.pids) and (self.tids is None or tid in self.tids)
+
+    def accepts_time(self, time):
+        (left, right) = self.window
+        return (left is None or time >= left) and (right is None or time <= right)
+
+    def before_window(self, time):  # for the readers which can't tell the ends, those of the tasks kept may come after the window
+        return self.window[0] is not None and time < self.window[0]
+
+    def accepts_domain(self, domain):
+        if self.domains is None:
+            return True
+        verdict = self.domain_verdicts.get(domain)
+        if verdict is None:
+            verdict = self.domain_verdicts[domain] = bool(self.domains.match(domain))
+        return verdict
+
+    def accepts_name(self, name):
+        if self.names is None or name is None:  # pointers are named once resolved
+            return True
+        verdict = self.name_verdicts.get(name)
+        if verdict is None:
+            verdict = self.name_verdicts[name] = bool(self.names.search(name))
+        return verdict
+
+    def accepts_event(self, fn, data):  # on the merged stream, everything but min_dur
+        type = TaskTypeIds.get(fn)
+        if type in self.Ends:
+            verdicts = self.opened.get((data.domain, data.tid, data.id if type != 1 else None, self.Ends[type]))
+            if verdicts:
+                return verdicts.pop()
+        verdict = self.accepts_thread(data.pid, data.tid) and self.accepts_time(data.time) and self.accepts_domain(data.domain) \
+            and (type not in self.Begins and type not in self.Instants or self.accepts_name(data.str))
+        if type in self.Begins and not data.delta:  # turbo tasks come without end
+            self.opened.setdefault((data.domain, data.tid, data.id if type != 0 else None, type), []).append(verdict)
+        return verdict
+
+    def accepts_task(self, type, begin, end):
+        return not self.min_dur or type != 'task' or not end or end['time'] - begin['time'] >= self.min_dur
+
+
 class Callbacks(TaskCombinerCommon):
     event_filter = default_event_filer
     task_postprocessor = None
@@ -1374,9 +1883,12 @@ class Callbacks(TaskCombinerCommon):
         self.callbacks = []  # while parsing we might have one to many 'listeners' - output format writers
         self.stack_sniffers = [] # only stack listeners
         self.limits = Callbacks.parse_limits(getattr(self.args, 'limit', None))
+        self.filter = EventFilter.from_args(self.args) or None  # None when --filter is not given, readers check it first
+        self.domain_filter = get_domain_filter()
         self.allowed_pids = set()
         self.processes = {}
         self.tasks_from_samples = {}
+        self.frame_names = {}  # (ptr, str) -> name of the sampled task
         self.on_finalize_callbacks = []
 
         collection = global_storage('collection')
@@ -1385,7 +1897,7 @@ class Callbacks(TaskCombinerCommon):
         else:
             self.allowed_pids = set()
         self.tid_map = self.get_globals()['tid_map']
-        if hasattr(self.args, 'user_input') and os.path.isdir(self.args.user_input):
+        if hasattr(self.args, 'user_input') and path_isdir(self.args.user_input):
             tid_map = build_tid_map(self.args, self.args.user_input)
             self.tid_map.update(tid_map)
             self.allowed_pids |= set(tid_map.values())
@@ -1413,7 +1925,7 @@ class Callbacks(TaskCombinerCommon):
 
         self.globals = self.get_globals()
         self.cpus = set()
-        self.all_cpus_started = os.path.isfile(self.args.user_input) or None
+        self.all_cpus_started = (os.path.isfile(self.args.user_input) and not path_isdir(self.args.user_input)) or None
         self.proc_names = {}
 
     @classmethod
@@ -1450,6 +1962,9 @@ class Callbacks(TaskCombinerCommon):
         [callback.__exit__(type, value, traceback) for callback in self.callbacks]  # emulating 'with' statement
         return False
 
+    def flush(self):  # --live: makes what is converted so far visible in the output files
+        [callback.flush() for callback in self.callbacks if hasattr(callback, 'flush')]
+
     def finalize(self):
         for decoder in self.sea_decoders:
             decoder.finalize()
@@ -1466,22 +1981,25 @@ class Callbacks(TaskCombinerCommon):
         self.finish()
 
     def on_event(self, type, data):
+        data = Record.from_dict(data)
+        if self.filter and not self.filter.accepts_event(type, data):
+            return False
         if self.event_filter:
             type, data, end = self.event_filter(type, data, None)
             if not type:
                 return False
 
-        if not self.check_pid_allowed(data['pid']) or not self.check_time_in_limits(data['time']):
-            return False
-
-        if not is_domain_enabled(data['domain']):
+        if not self.check_pid_allowed(data.pid) or not self.check_time_in_limits(data.time):
             return False
 
-        if data.get('internal_name', None) and not is_domain_enabled('%s.%s' % (data['domain'], data['internal_name'])):
+        if not self.domain_filter.is_enabled(data.domain):
             return False
 
-        if self.args.remove_args and 'args' in data:
-            del data['args']
+        if data.extra:
+            if data.extra.get('internal_name', None) and not self.domain_filter.is_enabled('%s.%s' % (data.domain, data.extra['internal_name'])):
+                return False
+            if self.args.remove_args and 'args' in data.extra:
+                del data.extra['args']
         self.__call__(type, data)
         return True
 
@@ -1490,10 +2008,12 @@ class Callbacks(TaskCombinerCommon):
             type, begin, end = self.event_filter(type, begin, end)
             if not type:
                 return False
+        if self.filter and not self.filter.accepts_task(type, begin, end):
+            return False
         if self.handle_special(type, begin, end):  # returns True if event is consumed and doesn't require processing
             return True
 
-        if not is_domain_enabled(begin['domain']):
+        if not self.domain_filter.is_enabled(begin['domain']):
             return False
 
         if self.check_pid_allowed(begin['pid']) and (self.check_time_in_limits(begin['time']) or (end and self.check_time_in_limits(end['time']))):
@@ -1502,8 +2022,13 @@ class Callbacks(TaskCombinerCommon):
                     del begin['args']
                 if 'args' in end:
                     del end['args']
-            # copy here as handler can change the data for own good - this shall not affect other handlers
-            [callback.complete_task(type, begin.copy(), end.copy() if end else end) for callback in self.callbacks]
+            # copy here as handler can change the data for own good - this shall not affect other handlers, the last one gets the original
+            last = len(self.callbacks) - 1
+            for index, callback in enumerate(self.callbacks):
+                if index < last:
+                    callback.complete_task(type, begin.copy(), end.copy() if end else end)
+                else:
+                    callback.complete_task(type, begin, end)
             return True
         else:
             return False
@@ -2051,15 +2576,22 @@ class Callbacks(TaskCombinerCommon):
             pid = -pid if pid > 100 else pid
             tid = -tid
 
-        # Find currently present tasks:
-        present = set()
+        names = self.frame_names
         for frame in stack:
-            ptr = frame['ptr']
-            if not frame['str']:
-                frame['str'] = '0x%x' % ptr
-            else:
-                frame['str'] = '%s(0x%x)' % (frame['str'], ptr)
-            present.add(ptr)
+            key = (frame['ptr'], frame['str'])
+            name = names.get(key)
+            if name is None:
+                name = names[key] = ('%s(0x%x)' % (key[1], key[0])) if key[1] else '0x%x' % key[0]
+            frame['str'] = name
+        stacks = get_stack_table(self.tree)
+        stack_id = stacks.add(stack)
+        sample = {'pid': pid, 'tid': tid, 'time': time}
+        if stack_id == getattr(tasks, 'stack_id', None):  # tasks are the frames of the last stack, nothing to change
+            return self.notify_stack(sample, stack_id, stack, kind)
+        tasks.stack_id = stack_id
+
+        # Find currently present tasks:
+        present = set(frame['ptr'] for frame in stack)
 
         # Remove currently absent tasks (they are finished):
         for ptr in tasks:
@@ -2117,8 +2649,13 @@ class Callbacks(TaskCombinerCommon):
             tasks[task['ptr']] = task
             shift += 1
 
-        for callback in self.callbacks + self.stack_sniffers:
-            callback.handle_stack({'pid': pid, 'tid': tid, 'time': time}, stack, kind)
+        self.notify_stack(sample, stack_id, stack, kind)
+
+    def notify_stack(self, task, stack_id, stack, kind):
+        for callback in self.callbacks:
+            callback.handle_interned_stack(task, stack_id, stack, kind)
+        for sniffer in self.stack_sniffers:
+            sniffer.handle_stack(task, stack, kind)
 
 
 
@@ -2138,79 +2675,249 @@ class Callbacks(TaskCombinerCommon):
 
 
 class FileWrapper:
-    def __init__(self, path, args, tree, domain, tid):
+    Header = struct.Struct('Qbb')  # header of the record, see STinyRecord in Recorder.cpp
+    Pair = struct.Struct('QQ')
+    Unsigned = struct.Struct('Q')
+    Signed = struct.Struct('q')
+    Double = struct.Struct('d')
+    BatchSize = 4096  # records decoded at once
+
+    def __init__(self, path, args, tree, domain, tid, limits=(None, None), watermark=None, read=True, fltr=None):  # read=False leaves the first record to next()
         self.args = args
         self.tree = tree
         self.domain = domain
         self.tid = tid
         self.next_wrapper = None
-        self.file = open(path, "rb")
-        self.record = self.read()
+        self.path = path
+        (self.file, self.buffer, self.base, self.size) = map_file(path)  # the stream is at base of buffer, see SeaPack
+        self.pos = self.base
+        self.end = self.base + self.size
+        self.time_range = None
+        self.watermark = watermark  # --live: the file is still written, records after this time aren't decoded yet
+        self.filter = fltr  # EventFilter, the records it drops aren't decoded further than their fields
+        self.name_verdicts = {}  # string handle -> verdict of the filter
+        self.late = None  # (tid, id, begin type) -> count of the begins dropped after the time window, not ended yet
+        if fltr:
+            if fltr.window[1] is not None and '-' not in os.path.basename(path):  # a task might go on into the next chunk
+                self.late = {}
+            if not fltr.accepts_domain(domain):
+                self.end = self.pos
+            if fltr.window[0] is not None:  # the ends of the tasks begun in the window may come after it, so only the left side seeks
+                limits = (max(limits[0], fltr.window[0]) if limits[0] is not None else fltr.window[0], limits[1])
+        if self.size and (limits[0] is not None or limits[1] is not None):  # seeking by the time index
+            index = SeaIndex.load(path, self.buffer, self.size, self.base)
+            (begin, end) = index.get_range(*limits)
+            (self.pos, self.end) = (self.base + begin, self.base + end)
+            self.time_range = index.get_time_range()
+        self.batch = []  # decoded records in reverse order, so that the next one is popped from the end
+        self.record = self.read() if read else None
 
     def __del__(self):
-        self.file.close()
+        if self.file:  # streams of .seapack share its mapping
+            if self.size:
+                self.buffer.close()
+            self.file.close()
 
     def next(self):
-        self.record = self.read()
+        self.record = self.batch.pop() if self.batch else self.read()
+
+    def follow(self, watermark):  # --live: maps what was appended since and reads on up to the new watermark
+        self.watermark = watermark
+        size = os.fstat(self.file.fileno()).st_size if self.file else self.size
+        if size > self.size:
+            if self.size:
+                self.buffer.close()
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.size = self.end = size
+        if not self.record:
+            self.record = self.read()
 
     def get_record(self):
         return self.record
 
     def get_pos(self):
-        return self.file.tell()
+        return self.pos - self.base
 
     def get_size(self):
-        return os.path.getsize(self.file.name)
+        return self.size
 
     def get_path(self):
-        return self.file.name
+        return self.path
 
     def read(self):
-        call = {"tid": self.tid, "pid": self.tree["pid"], "domain": self.domain}
+        if not self.batch:
+            self.batch = self.read_batch(self.BatchSize)
+            if not self.batch:
+                return None
+        return self.batch.pop()
 
-        tuple = read_chunk_header(self.file)
-        if tuple == (0, 0, 0):  # mem mapping wasn't trimmed on close, zero padding goes further
-            return None
-        call["time"] = tuple[0]
-
-        assert (tuple[1] < len(TaskTypes))  # sanity check
-        call["type"] = tuple[1]
-
-        flags = tuple[2]
-        if flags & 0x1:  # has id
-            chunk = self.file.read(2 * 8)
-            call["id"] = struct.unpack('QQ', chunk)[0]
-        if flags & 0x2:  # has parent
-            chunk = self.file.read(2 * 8)
-            call["parent"] = struct.unpack('QQ', chunk)[0]
-        if flags & 0x4:  # has string
-            chunk = self.file.read(8)
-            str_id = struct.unpack('Q', chunk)[0]  # string handle
-            call["str"] = self.tree["strings"][str_id]
-        if flags & 0x8:  # has tid, that differs from the calling thread (virtual tracks)
-            chunk = self.file.read(8)
-            call["tid"] = int(struct.unpack('q', chunk)[0])
-
-        if flags & 0x10:  # has data
-            chunk = self.file.read(8)
-            length = struct.unpack('Q', chunk)[0]
-            call["data"] = self.file.read(length).decode()
-
-        if flags & 0x20:  # has delta
-            chunk = self.file.read(8)
-            call["delta"] = struct.unpack('d', chunk)[0]
-
-        if flags & 0x40:  # has pointer
-            chunk = self.file.read(8)
-            ptr = struct.unpack('Q', chunk)[0]
-            if not resolve_pointer(self.args, self.tree, ptr, call):
-                call["pointer"] = ptr
-
-        if flags & 0x80:  # has pseudo pid
-            chunk = self.file.read(8)
-            call["pid"] = struct.unpack('q', chunk)[0]
-
-        return call
+    def batches(self):  # yields lists of records in time order, starting from the current one
+        if self.record:
+            yield [self.record] + self.batch[::-1]
+        self.batch = []
+        while True:
+            batch = self.read_batch(self.BatchSize)
+            if not batch:
+                break
+            batch.reverse()
+            yield batch
+        self.record = None
+
+    def read_batch(self, count):
+        buffer, pos, size = self.buffer, self.pos, self.base + self.size  # size is the end of stream in buffer
+        header, pair, unsigned, signed, double = self.Header, self.Pair, self.Unsigned, self.Signed, self.Double
+        strings = self.tree["strings"]
+        tid, pid, domain = self.tid, self.tree["pid"], self.domain
+        batch = []
+        append = batch.append
+        header_size = header.size
+        header_end = min(size, self.end) - header_size
+        type_count = len(TaskTypes)
+        watermark = self.watermark
+        defer = self.args.defer_symbols
+        fltr = self.filter
+        record_pos = pos
+        try:
+            while count and pos <= header_end:
+                (time, type, flags) = header.unpack_from(buffer, pos)
+                if not time and not type and not flags:  # mem mapping wasn't trimmed on close, zero padding goes further
+                    break  # or the writer didn't get here yet
+                if watermark is not None and time > watermark:  # might be still half written
+                    break
+                assert (type < type_count)  # sanity check
+                record_pos = pos
+                pos += header_size
+                call = Record(tid, pid, domain, time, type)
+                (handle, data, ptr) = (None, None, None)  # looked up once the record passes the filter
+
+                if flags & 0x1:  # has id
+                    call.id = pair.unpack_from(buffer, pos)[0]
+                    pos += pair.size
+                if flags & 0x2:  # has parent
+                    call.parent = pair.unpack_from(buffer, pos)[0]
+                    pos += pair.size
+                if flags & 0x4:  # has string
+                    handle = unsigned.unpack_from(buffer, pos)[0]
+                    pos += unsigned.size
+                if flags & 0x8:  # has tid, that differs from the calling thread (virtual tracks)
+                    call.tid = int(signed.unpack_from(buffer, pos)[0])
+                    pos += signed.size
+
+                if flags & 0x10:  # has data
+                    length = unsigned.unpack_from(buffer, pos)[0]
+                    pos += unsigned.size
+                    if pos + length > size:
+                        raise struct.error('data is out of file bounds')
+                    data = buffer[pos:pos + length]
+                    pos += length
+
+                if flags & 0x20:  # has delta
+                    call.delta = double.unpack_from(buffer, pos)[0]
+                    pos += double.size
+
+                if flags & 0x40:  # has pointer
+                    ptr = unsigned.unpack_from(buffer, pos)[0]
+                    pos += unsigned.size
+
+                if flags & 0x80:  # has pseudo pid
+                    call.pid = signed.unpack_from(buffer, pos)[0]
+                    pos += signed.size
+
+                if pos > size:  # the buffer goes on after the stream in .seapack
+                    raise struct.error('record is out of stream bounds')
+
+                if fltr is not None:
+                    verdict = self.accepts(call, handle)
+                    if not verdict:
+                        if verdict is False:
+                            continue
+                        (handle, data, ptr) = (None, None, None)  # Callbacks.on_event drops it by the time and its end with it
+                if handle is not None:
+                    call.str = strings[handle]
+                if data is not None:
+                    call.data = data if type in StackTypes else data.decode()  # the stack stays binary, see decode_stack
+                if ptr is not None:
+                    if defer:  # named by the placeholder until the exporter resolves it, as the symbol would name it
+                        (call.str, call.pointer) = (None, ptr)
+                    elif not resolve_pointer(self.args, self.tree, ptr, call):
+                        call.pointer = ptr
+                count -= 1
+                append(call)
+        except struct.error:  # the last record is truncated, the writer was killed
+            if watermark is not None:  # or the file grew beyond our mapping, retrying after follow
+                pos = record_pos
+            else:
+                message('warning', 'Truncated record at %d in %s' % (record_pos, self.get_path()))
+                pos = size
+        self.pos = pos
+        batch.reverse()
+        return batch
+
+    def accepts(self, call, handle):  # False drops the record, None passes it on undecoded, names of tasks are left to Callbacks.on_event
+        fltr = self.filter
+        if not fltr.accepts_thread(call.pid, call.tid):
+            return False
+        if call.type in fltr.Ends:  # its begin decides, see EventFilter.accepts_event
+            if self.late:  # the begins dropped after the window end before the tasks kept, as they are nested in them
+                key = (call.tid, call.id if call.type != 1 else None, fltr.Ends[call.type])
+                if self.late.get(key):
+                    self.late[key] -= 1
+                    return False
+            return True
+        if call.type in fltr.Begins:
+            if fltr.before_window(call.time):
+                return False
+            if not fltr.accepts_time(call.time):  # after the window, its end has to be told from the ends of the tasks kept
+                if self.late is None:
+                    return None
+                if not call.delta:  # turbo tasks come without end
+                    key = (call.tid, call.id if call.type != 0 else None, call.type)
+                    self.late[key] = self.late.get(key, 0) + 1
+                return False
+        elif not fltr.accepts_time(call.time):
+            return False
+        if handle is None or call.type not in fltr.Instants:
+            return True
+        verdict = self.name_verdicts.get(handle)
+        if verdict is None:
+            verdict = self.name_verdicts[handle] = fltr.accepts_name(self.tree['strings'][handle])
+        return verdict
+
+    def get_pointers(self, pointers, stacks):  # pre-pass of prefetch_symbols: adds pointers and stack blobs of the records yet to read
+        buffer, header, unsigned = self.buffer, self.Header, self.Unsigned
+        header_size = header.size
+        payload_sizes, data_offsets, pointer_offsets = SeaIndex.PayloadSizes, SeaIndex.DataOffsets, SeaIndex.PointerOffsets
+        pos = self.pos
+        end = min(self.base + self.size, self.end)
+        watermark = self.watermark
+        fltr = self.filter
+        stream_accepted = not fltr or fltr.accepts_thread(self.tree['pid'], self.tid)  # records of virtual tracks and pseudo pids are prefetched anyway
+        while pos + header_size <= end:
+            (time, type, flags) = header.unpack_from(buffer, pos)
+            if not time and not type and not flags:
+                break
+            if watermark is not None and time > watermark:
+                break
+            flags &= 0xFF
+            payload = pos + header_size
+            length = payload_sizes[flags]
+            data_length = 0
+            if flags & 0x10:
+                data_pos = payload + data_offsets[flags]
+                if data_pos + unsigned.size > end:
+                    break
+                data_length = unsigned.unpack_from(buffer, data_pos)[0]
+                length += data_length
+            if payload + length > end:
+                break
+            if fltr and ((not stream_accepted and not flags & 0x88) or not fltr.accepts_time(time)):  # read_batch drops it before the symbols
+                pos = payload + length
+                continue
+            if data_length and type in StackTypes:
+                stacks.add(buffer[data_pos + unsigned.size:data_pos + unsigned.size + data_length])
+            if flags & 0x40:
+                pointers.add(unsigned.unpack_from(buffer, payload + pointer_offsets[flags] + data_length)[0])
+            pos = payload + length
 
     def set_next(self, wrapper):
         self.next_wrapper = wrapper
@@ -2219,92 +2926,598 @@ class FileWrapper:
         return self.next_wrapper
 
 
+RecordFlagSizes = [(0x1, 16), (0x2, 16), (0x4, 8), (0x8, 8), (0x10, 8), (0x20, 8), (0x40, 8), (0x80, 8)]  # 0x10 is followed by the data
+StackTypes = frozenset([0, 2, 6])  # with --stacks the data of task begins and counters is the stack, see Recorder.cpp
+
+
+class SeaIndex:
+    """
+    Sidecar time index of .sea file: '<tid>.seaidx' next to '<tid>.sea'.
+    Each bucket of Step records keeps its byte offset and time bounds, so that --limit reads only the relevant part.
+    """
+    Extension = '.seaidx'
+    Magic = b'SEAIDX1\0'
+    Head = struct.Struct('8sQQQ')  # magic, size of indexed .sea file, end of records, count of buckets
+    Bucket = struct.Struct('QQQ')  # offset, min time, max time
+    Step = 4096  # records per bucket
+
+    # payload sizes of the record by its flags, see FileWrapper.read_batch
+    PayloadSizes = [sum(size for flag, size in RecordFlagSizes if flags & flag) for flags in range(256)]
+    DataOffsets = [sum(size for flag, size in RecordFlagSizes if flags & flag and flag < 0x10) for flags in range(256)]
+    PointerOffsets = [sum(size for flag, size in RecordFlagSizes if flags & flag and flag < 0x40) for flags in range(256)]  # plus the data
+
+    def __init__(self, buckets, end):
+        self.buckets = buckets
+        self.end = end
+
+    @staticmethod
+    def get_path(path):
+        return os.path.splitext(path)[0] + SeaIndex.Extension
+
+    @classmethod
+    def build(cls, buffer, size, base=0):  # the stream is at base of buffer, offsets are relative to it
+        header, unsigned = FileWrapper.Header, FileWrapper.Unsigned
+        header_size = header.size
+        payload_sizes, data_offsets = cls.PayloadSizes, cls.DataOffsets
+        buckets = []
+        pos = base
+        size += base
+        count = 0
+        while pos + header_size <= size:
+            (time, type, flags) = header.unpack_from(buffer, pos)
+            if not time and not type and not flags:  # zero padding of the untrimmed mapping
+                break
+            flags &= 0xFF
+            length = payload_sizes[flags]
+            if flags & 0x10:
+                data_pos = pos + header_size + data_offsets[flags]
+                if data_pos + unsigned.size > size:
+                    break
+                length += unsigned.unpack_from(buffer, data_pos)[0]
+            if pos + header_size + length > size:  # truncated record
+                break
+            if count % cls.Step:
+                bucket = buckets[-1]
+                if time < bucket[1]:
+                    bucket[1] = time
+                elif time > bucket[2]:
+                    bucket[2] = time
+            else:
+                buckets.append([pos - base, time, time])
+            count += 1
+            pos += header_size + length
+        return cls([tuple(bucket) for bucket in buckets], pos - base)
+
+    @classmethod
+    def read(cls, path, size):
+        try:
+            with open_file(cls.get_path(path), 'rb') as file:
+                content = file.read()
+        except (IOError, OSError):
+            return None
+        if len(content) < cls.Head.size:
+            return None
+        (magic, indexed_size, end, count) = cls.Head.unpack_from(content, 0)
+        if magic != cls.Magic or indexed_size != size or len(content) != cls.Head.size + count * cls.Bucket.size:
+            return None  # stale or foreign index
+        buckets = [cls.Bucket.unpack_from(content, cls.Head.size + i * cls.Bucket.size) for i in range(count)]
+        return cls(buckets, end)
+
+    def write(self, path, size):
+        content = [self.Head.pack(self.Magic, size, self.end, len(self.buckets))]
+        content += [self.Bucket.pack(*bucket) for bucket in self.buckets]
+        try:
+            with open(self.get_path(path), 'wb') as file:
+                file.write(b''.join(content))
+        except IOError as exc:
+            message('warning', "Can't write index %s: %s" % (self.get_path(path), str(exc)))
+
+    @classmethod
+    def load(cls, path, buffer, size, base=0):  # reads the sidecar index or builds and writes it on first use
+        index = cls.read(path, size)
+        if not index:
+            index = cls.build(buffer, size, base)
+            if not SeaPack.split(path)[0]:  # .seapack is read only
+                index.write(path, size)
+        return index
+
+    def get_range(self, left, right):  # byte range of buckets which might have records within the limits
+        begin, end = 0, len(self.buckets)
+        if left is not None:
+            while begin < end and self.buckets[begin][2] < left:  # the whole bucket is before the limit
+                begin += 1
+        if right is not None:
+            while end > begin and self.buckets[end - 1][1] > right:  # the whole bucket is after the limit
+                end -= 1
+        if begin == end:
+            return self.end, self.end
+        return self.buckets[begin][0], (self.buckets[end][0] if end < len(self.buckets) else self.end)
+
+    def get_time_range(self):
+        if not self.buckets:
+            return None
+        return min(bucket[1] for bucket in self.buckets), max(bucket[2] for bucket in self.buckets)
+
+
+def index_collection(paths):  # 'index' command: writes time indices for all .sea files of the collections
+    for path in paths:
+        for sea_file in glob(os.path.join(path, '*.sea')) + glob(os.path.join(path, '*', '*.sea')) + glob(os.path.join(path, '*', '*', '*.sea')):
+            size = os.path.getsize(sea_file)
+            if not size:
+                continue
+            with open(sea_file, 'rb') as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    index = SeaIndex.build(buffer, size)
+                finally:
+                    buffer.close()
+            index.write(sea_file, size)
+            print('Indexed:', sea_file, len(index.buckets), 'buckets')
+
+
+class SeaPack:
+    """
+    Collection folder packed in one file: '<collection>.seapack', see 'pack' and 'unpack' commands.
+    The files go one after another, each stored as is or compressed, followed by the directory of entries.
+    Paths inside are addressed as if .seapack was the folder: '<collection>.seapack/pid-<pid>/<domain>/<tid>.sea'.
+    """
+    Extension = '.seapack'
+    Magic = b'SEAPACK1'
+    Head = struct.Struct('=8sQQ')  # magic, offset of the directory, count of entries
+    Entry = struct.Struct('=QQQBH')  # offset, stored size, size, compression, length of the utf-8 name that follows
+    Compressions = ['none', 'zlib', 'lzma']
+    Opened = {}  # path -> SeaPack, the packs stay mapped till the exit
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, directory, count) = self.Head.unpack_from(self.buffer, 0)
+        if magic != self.Magic:
+            raise IOError('Not a %s file: %s' % (self.Extension, path))
+        self.entries = {}  # name -> (offset, stored size, size, compression)
+        self.folders = {'': ([], [])}  # name -> (sub folders, files) in the order of packing
+        pos = directory
+        for i in range(count):
+            entry = self.Entry.unpack_from(self.buffer, pos)
+            pos += self.Entry.size
+            name = self.buffer[pos:pos + entry[-1]].decode('utf-8')
+            pos += entry[-1]
+            self.entries[name] = entry[:-1]
+            (folder, filename) = name.rsplit('/', 1) if '/' in name else ('', name)
+            self.add_folder(folder)[1].append(filename)
+
+    def add_folder(self, name):
+        if name not in self.folders:
+            self.folders[name] = ([], [])
+            (parent, folder) = name.rsplit('/', 1) if '/' in name else ('', name)
+            self.add_folder(parent)[0].append(folder)
+        return self.folders[name]
+
+    @classmethod
+    def split(cls, path):  # returns (SeaPack, name inside) for the paths into .seapack, (None, path) otherwise
+        path = path.replace('\\', '/')
+        pos = path.find(cls.Extension)
+        while pos != -1:
+            end = pos + len(cls.Extension)
+            if end == len(path) or path[end] == '/':
+                pack = path[:end]
+                if pack in cls.Opened or os.path.isfile(pack):
+                    if pack not in cls.Opened:
+                        cls.Opened[pack] = cls(pack)
+                    return cls.Opened[pack], path[end + 1:].rstrip('/')
+            pos = path.find(cls.Extension, end)
+        return None, path
+
+    def map(self, name):  # returns (buffer, base, size) of the stream
+        (offset, stored, size, compression) = self.entries[name]
+        if not compression:
+            return self.buffer, offset, size
+        return self.read(name), 0, size
+
+    def read(self, name):
+        if name not in self.entries:
+            raise IOError('No such file in %s: %s' % (self.path, name))
+        (offset, stored, size, compression) = self.entries[name]
+        content = self.buffer[offset:offset + stored]
+        if compression:
+            content = get_compressor(self.Compressions[compression]).decompress(content)
+        return content
+
+    def list_dir(self, name):  # returns (sub folders, files) as os.walk does
+        return self.folders[name]
+
+    @classmethod
+    def create(cls, path, folder, compression='none'):
+        compressor = get_compressor(compression) if compression != 'none' else None
+        with open(path, 'wb') as pack:
+            pack.write(cls.Head.pack(cls.Magic, 0, 0))
+            directory = []
+            for root, folders, files in os.walk(folder):
+                if root == folder and 'transform' in folders:  # the output of conversions
+                    folders.remove('transform')
+                for filename in files:
+                    full_path = os.path.join(root, filename)
+                    name = os.path.relpath(full_path, folder).replace('\\', '/')
+                    with open(full_path, 'rb') as file:
+                        content = file.read()
+                    method = 0
+                    if compressor and content:  # per stream: it's stored as is if compression doesn't help
+                        compressed = compressor.compress(content)
+                        if len(compressed) < len(content):
+                            method = cls.Compressions.index(compression)
+                    stored = compressed if method else content
+                    directory.append((pack.tell(), len(stored), len(content), method, name.encode('utf-8')))
+                    pack.write(stored)
+            offset = pack.tell()
+            for entry in directory:
+                pack.write(cls.Entry.pack(*(entry[:-1] + (len(entry[-1]),))) + entry[-1])
+            pack.seek(0)
+            pack.write(cls.Head.pack(cls.Magic, offset, len(directory)))
+        return len(directory)
+
+    def get_path(self, folder, name):  # the names come from the file, those leading out of the folder are refused
+        parts = name.split('/')
+        root = os.path.realpath(folder)
+        path = os.path.join(folder, *parts)
+        real = os.path.realpath(path)
+        if name.startswith('/') or '..' in parts or (real != root and not real.startswith(root + os.sep)):
+            raise IOError('Bad entry name in %s: %s' % (self.path, name))
+        return path
+
+    def extract(self, folder):
+        for name in self.entries:
+            path = self.get_path(folder, name)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as file:
+                file.write(self.read(name))
+        for name in self.folders:  # empty domain folders are kept too
+            path = self.get_path(folder, name)
+            if not os.path.exists(path):
+                os.makedirs(path)
+        return len(self.entries)
+
+
+def get_compressor(name):
+    if name == 'zlib':
+        import zlib
+        return zlib
+    try:
+        import lzma
+    except ImportError:
+        message('error', 'lzma compression requires python 3.3+')
+        raise
+    return lzma
+
+
+def map_file(path):  # returns (file, buffer, base, size), file is None for the streams of .seapack which share its buffer
+    (pack, name) = SeaPack.split(path)
+    if pack:
+        return (None,) + pack.map(name)
+    file = open(path, 'rb')
+    size = os.fstat(file.fileno()).st_size
+    return file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b'', 0, size
+
+
+def open_file(path, mode='r'):  # reads files of the collection folder or of .seapack
+    (pack, name) = SeaPack.split(path)
+    if not pack:
+        return open(path, mode)
+    import io
+    content = pack.read(name)
+    return io.BytesIO(content) if 'b' in mode else io.StringIO(content.decode('utf-8'))
+
+
+def path_exists(path):
+    (pack, name) = SeaPack.split(path)
+    if not pack:
+        return os.path.exists(path)
+    return name in pack.entries or name in pack.folders
+
+
+def path_isdir(path):
+    (pack, name) = SeaPack.split(path)
+    if not pack:
+        return os.path.isdir(path)
+    return name in pack.folders
+
+
+def list_dir(path):  # returns (sub folders, files)
+    (pack, name) = SeaPack.split(path)
+    if not pack:
+        return next(os.walk(path))[1:]
+    return pack.list_dir(name)
+
+
+def find_files(folder, pattern):  # glob of one level
+    (pack, name) = SeaPack.split(folder)
+    if not pack:
+        return glob(os.path.join(folder, pattern))
+    (folders, files) = pack.list_dir(name)
+    return [folder.rstrip('/\\') + '/' + item for item in folders + files if fnmatch.fnmatch(item, pattern)]
+
+
+def pack_collection(argv):  # 'pack' command
+    import argparse
+    parser = argparse.ArgumentParser(prog='sea_runtool.py pack', description='Packs collection folder into %s file' % SeaPack.Extension)
+    parser.add_argument('input', help='Collection folder')
+    parser.add_argument('-o', '--output', help='Defaults to <input>%s' % SeaPack.Extension)
+    parser.add_argument('-c', '--compression', choices=SeaPack.Compressions, default='none', help='Per stream, streams which do not shrink are stored as is')
+    args = parser.parse_args(argv)
+    output = args.output or args.input.rstrip('/\\') + SeaPack.Extension
+    count = SeaPack.create(output, args.input, args.compression)
+    print('Packed:', output, count, 'files', format_bytes(os.path.getsize(output)))
+
+
+def unpack_collection(argv):  # 'unpack' command
+    import argparse
+    parser = argparse.ArgumentParser(prog='sea_runtool.py unpack', description='Extracts %s file into collection folder' % SeaPack.Extension)
+    parser.add_argument('input', help='%s file' % SeaPack.Extension)
+    parser.add_argument('-o', '--output', help='Defaults to <input> without extension')
+    args = parser.parse_args(argv)
+    output = args.output or os.path.splitext(args.input)[0]
+    count = SeaPack(args.input).extract(output)
+    print('Unpacked:', output, count, 'files')
+
+
 def transform2(args, tree, skip_fn=None):
     with Callbacks(args, tree) as callbacks:
         if callbacks.is_empty():
             return callbacks.get_result()
+        merge_files(args, tree, [(callbacks, skip_fn)])
+    return callbacks.get_result()
 
-        wrappers = {}
-        for domain, content in tree["domains"].items():  # go thru domains
-            for tid, path in content["files"]:  # go thru per thread files
-                parts = split_filename(path)
-
-                file_wrapper = FileWrapper(path, args, tree, domain, tid)
-                if file_wrapper.get_record():  # record is None if something wrong with file reading
-                    wrappers.setdefault(parts['dir'] + '/' + parts['name'], []).append(file_wrapper)
-
-        for unordered in wrappers.values():  # chain wrappers by time
-            ordered = sorted(unordered, key=lambda wrapper: wrapper.get_record()['time'])
-            prev = None
-            for wrapper in ordered:
-                if prev:
-                    prev.set_next(wrapper)
-                prev = wrapper
-
-        files = []
-        (left_limit, right_limit) = callbacks.get_limits()
-        for unordered in wrappers.values():
-            for wrapper in unordered:
-                if right_limit and wrapper.get_record()['time'] > right_limit:
-                    continue
-                next = wrapper.get_next()
-                if left_limit and next and next.get_record()['time'] < left_limit:
-                    continue
-                if skip_fn and skip_fn(wrapper.get_path()):  # for "cut" support
-                    continue
-                files.append(wrapper)
 
-        if verbose_level() > verbose_level('warning'):
-            progress = DummyWith()
-        else:
-            size = sum([file.get_size() for file in files])
-            progress = Progress(size, 50, strings.converting % (os.path.basename(args.input), format_bytes(size)))
-
-        with progress:
-            count = 0
-            while True:  # records iteration
-                record = None
-                earliest = None
-                for file in files:
-                    rec = file.get_record()
-                    if not rec:  # finished
-                        continue
-                    if not record or rec['time'] < record['time']:
-                        record = rec
-                        earliest = file
-                if not record:  # all finished
+def transform_cuts(args, tree, cuts):  # one pass over the files, each cut gets own Callbacks with 'output!cut'
+    output = args.output[:]  # deep copy
+    pipelines = []
+    entered = []
+    exc_info = (None, None, None)
+    try:
+        for current_cut in cuts:
+            print("Cut #", current_cut if current_cut else "<None>")
+            cut_args = copy.copy(args)
+            cut_args.output = (output + "!" + current_cut) if current_cut else output
+            callbacks = Callbacks(cut_args, tree)
+            vars(args).update(vars(cut_args))  # exporters may consume args.trace or set args.sync for the next cuts, as in a sequential run
+            entered.append(callbacks.__enter__())
+            pipelines.append((callbacks, get_cut_filter(current_cut)))
+        if not all(callbacks.is_empty() for callbacks, _ in pipelines):
+            merge_files(args, tree, pipelines)
+    except:
+        exc_info = sys.exc_info()
+        raise
+    finally:
+        for callbacks in entered:
+            callbacks.__exit__(*exc_info)
+        args.output = output
+    result = []
+    for callbacks, _ in pipelines:
+        result += callbacks.get_result()
+    return result
+
+
+def get_cut_filter(current_cut):
+    def skip_fn(path):
+        filename = os.path.split(path)[1]
+        if current_cut:  # read only those having this cut name in filename
+            if current_cut != split_filename(filename)['cut']:
+                return True
+        else:  # reading those having not cut name in filename
+            if "!" in filename:
+                return True
+        return False
+    return skip_fn
+
+
+def merge_files(args, tree, pipelines):  # pipelines is list of (callbacks, skip_fn), each file goes to the first not skipping it
+    main_callbacks = pipelines[0][0]
+    wrappers = {}
+    limits = main_callbacks.get_limits()
+    opened = []
+    for domain, content in tree["domains"].items():  # go thru domains
+        for tid, path in content["files"]:  # go thru per thread files
+            opened.append(FileWrapper(path, args, tree, domain, tid, limits, read=False, fltr=main_callbacks.filter))
+    if (tree['modules'] or 'jit' in tree) and not args.defer_symbols:  # before the first records get decoded
+        prefetch_file_symbols(args, tree, opened)
+
+    for file_wrapper in opened:
+        parts = split_filename(file_wrapper.get_path())
+        file_wrapper.next()
+        if file_wrapper.time_range:  # the skipped records still count for the real time range
+            for time_stamp in file_wrapper.time_range:
+                main_callbacks.check_time_in_limits(time_stamp)
+        chain = wrappers.setdefault(parts['dir'] + '/' + parts['name'], [])  # keeps the order of threads when seeking skips a whole file
+        if file_wrapper.get_record():  # record is None if something wrong with file reading or it's out of limits
+            chain.append(file_wrapper)
+
+    for unordered in wrappers.values():  # chain wrappers by time
+        ordered = sorted(unordered, key=lambda wrapper: wrapper.get_record().time)
+        prev = None
+        for wrapper in ordered:
+            if prev:
+                prev.set_next(wrapper)
+            prev = wrapper
+
+    files = []
+    targets = []  # callbacks per file
+    (left_limit, right_limit) = limits
+    for unordered in wrappers.values():
+        for wrapper in unordered:
+            if right_limit and wrapper.get_record().time > right_limit:
+                continue
+            next = wrapper.get_next()
+            if left_limit and next and next.get_record().time < left_limit:
+                continue
+            for callbacks, skip_fn in pipelines:
+                if not (skip_fn and skip_fn(wrapper.get_path())):  # for "cut" support
+                    files.append(wrapper)
+                    targets.append(callbacks)
                     break
-                earliest.next()
 
-                if message('info', "%d\t%s\t%s" % (count, TaskTypes[record['type']], record)):
-                    pass
-                elif count % ProgressConst == 0:
-                    progress.tick(sum([file.get_pos() for file in files]))
-                callbacks.on_event(TaskTypes[record['type']], record)
-                count += 1
+    if verbose_level() > verbose_level('warning'):
+        progress = DummyWith()
+    else:
+        size = sum([file.get_size() for file in files])
+        progress = Progress(size, 50, strings.converting % (os.path.basename(args.input), format_bytes(size)))
+
+    with progress:
+        merge_records(files, targets, progress)
+
+    for callbacks, _ in pipelines:
+        add_process_metadata(callbacks, tree)
+
+
+def prefetch_file_symbols(args, tree, files):  # resolves all pointers of the files before the merge needs them one by one
+    start = time.time()
+    pointers = set()
+    stacks = set()
+    for file in files:
+        file.get_pointers(pointers, stacks)
+    for stack in stacks:
+        pointers.update(decode_stack(tree, stack))
+    count = prefetch_symbols(args, tree, pointers)
+    message('info', 'Resolved %d of %d pointers in %.2f seconds' % (count, len(pointers), time.time() - start))
+
+
+def merge_records(files, targets, progress=None):  # passes records of files ordered by time to their targets
+    count = 0
+    info = verbose_level('info') <= verbose_level()  # formatting of every record costs even if it isn't printed
+    # k-way merge: heap of (time, index, file), index keeps the files order for equal times
+    heap = [(file.get_record().time, index, file) for index, file in enumerate(files) if file.get_record()]
+    heapq.heapify(heap)
+    while heap:  # records iteration
+        (_, index, earliest) = heap[0]
+        record = earliest.get_record()
+        earliest.next()
+        rec = earliest.get_record()
+        if rec:
+            heapq.heapreplace(heap, (rec.time, index, earliest))
+        else:  # finished, or waits for the next watermark in --live
+            heapq.heappop(heap)
+
+        if info and message('info', "%d\t%s\t%s" % (count, TaskTypes[record.type], record)):
+            pass
+        elif progress and count % ProgressConst == 0:
+            progress.tick(sum([file.get_pos() for file in files]))
+        targets[index].on_event(TaskTypes[record.type], record)
+        count += 1
+    return count
 
-        callbacks("metadata_add", {'domain': 'IntelSEAPI', 'str': '__process__', 'pid': tree["pid"], 'tid': -1, 'delta': -1})
-        for pid, name in tree['groups'].items():
-            callbacks.set_process_name(tree["pid"], name)
 
-    return callbacks.get_result()
+def add_process_metadata(callbacks, tree):
+    callbacks("metadata_add", {'domain': 'IntelSEAPI', 'str': '__process__', 'pid': tree["pid"], 'tid': -1, 'delta': -1})
+    for pid, name in tree['groups'].items():
+        callbacks.set_process_name(tree["pid"], name)
+
+
+class LiveTransformer:  # --live: converts .sea files while the target still writes them
+    def __init__(self, args, sea_itf):
+        self.args = args
+        self.sea_itf = sea_itf  # its timestamps are of the same clock as records
+        self.lag = int(args.live * 1000000000)  # records younger than this might be still half written
+        self.processes = {}  # folder -> LiveProcess
+
+    def get_folders(self):
+        if self.args.single:
+            return [folder for folder in glob(self.args.output + '-*') if os.path.isdir(folder)]
+        return [folder for folder in glob(os.path.join(self.args.output, 'pid-*')) if os.path.isdir(folder)]
+
+    def follow(self, proc, interval=1):
+        while proc.poll() is None:
+            self.poll(self.sea_itf.get_timestamp() - self.lag)
+            time.sleep(interval)
+
+    def poll(self, watermark):  # watermark is None when the writers are done
+        for folder in self.get_folders():
+            if folder not in self.processes and os.path.exists(os.path.join(folder, 'process.dct')):
+                self.processes[folder] = LiveProcess(self.args, folder)
+        for process in self.processes.values():
+            process.poll(watermark)
+
+    def finish(self):  # returns outputs per process folder
+        self.poll(None)
+        return dict((folder, process.finish()) for folder, process in self.processes.items())
+
+
+class LiveProcess:
+    def __init__(self, args, folder):
+        self.args = copy.copy(args)
+        self.args.input = folder
+        self.args.user_input = folder if args.single else args.output  # as transform_all sets it
+        if not args.single:
+            self.args.output = args.output + '.' + os.path.basename(folder)
+        ensure_dir(os.path.join(self.args.user_input, 'transform'), True)  # transform_all finds it done
+        self.tree = sea_reader(self.args, pack=False)
+        self.callbacks = Callbacks(self.args, self.tree).__enter__()
+        self.files = []
+        self.paths = set()
+
+    def refresh(self):  # new threads, domains and handles appear while the target runs
+        tree = sea_reader(self.args, pack=False)
+        for key in ['strings', 'threads', 'groups', 'modules']:
+            self.tree[key].update(tree[key])
+        self.tree['domains'] = tree['domains']
+        for domain, content in tree['domains'].items():
+            for tid, path in content['files']:
+                if path not in self.paths:
+                    self.paths.add(path)
+                    self.files.append(FileWrapper(path, self.args, self.tree, domain, tid, watermark=-1, fltr=self.callbacks.filter))
+
+    def poll(self, watermark):
+        self.refresh()
+        for file in self.files:
+            file.follow(watermark)
+        if not self.callbacks.is_empty():
+            merge_records(self.files, [self.callbacks] * len(self.files))
+        self.callbacks.flush()
+
+    def finish(self):
+        add_process_metadata(self.callbacks, self.tree)
+        self.callbacks.__exit__(None, None, None)
+        return self.callbacks.get_result()
 
 
 # FIXME: doesn't belong this file, move to 'utils'
 
+class ModuleIndex:
+    """
+    Ranges of tree['modules'] sorted by load address in flat arrays, lookups bisect the starts.
+    It is immutable, get_module_index builds new one when importers or live refresh add modules.
+    """
+
+    def __init__(self, modules):
+        ranges = sorted((int(start), int(module[1]), module[0]) for start, module in modules.items())
+        self.count = len(modules)
+        self.starts = array('Q', [start for start, size, path in ranges])
+        self.ends = array('Q', [start + size for start, size, path in ranges])
+        self.paths = [path for start, size, path in ranges]
+        self.sizes = dict((path, size) for start, size, path in ranges)
+        self.local = {}  # path -> the file to symbolize it by, None if there is none
+
+    def find(self, ptr):  # returns (load address, path) or (None, None)
+        index = bisect.bisect_right(self.starts, ptr) - 1
+        if index < 0 or not self.starts[index] < ptr < self.ends[index]:
+            return None, None
+        return self.starts[index], self.paths[index]
+
+    def locate(self, path, store=None):  # the copy in symbol store goes first, the path might be of the other machine
+        if path not in self.local:
+            local = store.find(path, self.sizes[path]) if store else None
+            self.local[path] = local or (path if os.path.exists(path) else None)
+        return self.local[path]
+
+
+def get_module_index(tree):
+    index = tree.get('module_index')
+    if index is None or index.count != len(tree['modules']):
+        index = tree['module_index'] = ModuleIndex(tree['modules'])
+    return index
+
+
 def get_module_by_ptr(tree, ptr):
-    keys = list(tree['modules'].keys())
-    keys.sort()  # looking for first bigger the address, previous is the module we search for
-    item = keys[0]
-    for key in keys[1:]:
-        if key > ptr:
-            break
-        item = key
-    module = tree['modules'][item]
-    if item < ptr < item + int(module[1]):
-        return item, module[0]
-    else:
-        return None, None
+    return get_module_index(tree).find(ptr)
 
 
 def win_parse_symbols(symbols):
@@ -2333,6 +3546,584 @@ def win_resolve(symbols, addr):
     return ''
 
 
+class ElfSymbols:
+    """
+    Functions of .symtab and .dynsym of ELF module sorted by address in flat arrays, resolve bisects the starts.
+    The name of .mdl is the address the ELF header is mapped to, so pointers are moved to link time addresses by the first PT_LOAD.
+    """
+    Types = (2, 10)  # STT_FUNC, STT_GNU_IFUNC
+    Page = 0x1000
+
+    def __init__(self):
+        self.base = 0  # link time address of the ELF header
+        self.build_id = None
+        self.starts = array('Q')
+        self.ends = array('Q')
+        self.names = array('Q')  # offsets in strings
+        self.strings = b''  # string tables of .symtab and .dynsym concatenated
+
+    @classmethod
+    def parse(cls, path):  # returns None for files that aren't ELF
+        with open(path, 'rb') as file:
+            try:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):  # empty file
+                return None
+            try:
+                return cls.parse_buffer(buffer)
+            except struct.error:  # truncated
+                return None
+            finally:
+                buffer.close()
+
+    @classmethod
+    def parse_buffer(cls, buffer):
+        if buffer[:4] != b'\x7fELF':
+            return None
+        order = '<' if buffer[5:6] == b'\x01' else '>'
+        if buffer[4:5] == b'\x02':  # 64 bit
+            (phoff, shoff) = struct.unpack_from(order + 'QQ', buffer, 0x20)
+            (phentsize, phnum, shentsize, shnum) = struct.unpack_from(order + 'HHHH', buffer, 0x36)
+            (phdr, vaddr) = (order + 'IIQQ', 3)  # type, flags, offset, vaddr
+            shdr = order + 'IIQQQQIIQQ'  # name, type, flags, addr, offset, size, link, info, addralign, entsize
+            sym = struct.Struct(order + 'IBBHQQ')  # name, info, other, shndx, value, size
+            (name_at, info_at, shndx_at, value_at, size_at) = (0, 1, 3, 4, 5)
+        else:
+            (phoff, shoff) = struct.unpack_from(order + 'II', buffer, 0x1c)
+            (phentsize, phnum, shentsize, shnum) = struct.unpack_from(order + 'HHHH', buffer, 0x2a)
+            (phdr, vaddr) = (order + 'III', 2)  # type, offset, vaddr
+            shdr = order + 'IIIIIIIIII'
+            sym = struct.Struct(order + 'IIIBBH')  # name, value, size, info, other, shndx
+            (name_at, info_at, shndx_at, value_at, size_at) = (0, 3, 5, 1, 2)
+        elf = cls()
+        loads = [header[vaddr] for header in (struct.unpack_from(phdr, buffer, phoff + i * phentsize) for i in range(phnum)) if header[0] == 1]  # PT_LOAD
+        if loads:
+            elf.base = min(loads) & ~(cls.Page - 1)
+        sections = [struct.unpack_from(shdr, buffer, shoff + i * shentsize) for i in range(shnum)]
+        symbols = []
+        strings = []
+        strings_size = 0
+        for section in sections:
+            (type, offset, size, link, entsize) = (section[1], section[4], section[5], section[6], section[9])
+            if type == 7 and not elf.build_id:  # SHT_NOTE
+                elf.build_id = cls.get_build_id(buffer, order, offset, offset + size)
+            if type not in (2, 11) or not entsize or link >= len(sections):  # SHT_SYMTAB, SHT_DYNSYM
+                continue
+            table = sections[link]
+            strings.append(buffer[table[4]:table[4] + table[5]])
+            for pos in range(offset, offset + size - entsize + 1, entsize):
+                entry = sym.unpack_from(buffer, pos)
+                info = entry[info_at]
+                shndx = entry[shndx_at]
+                if (info & 0xf) in cls.Types and 0 < shndx < len(sections) and entry[value_at]:
+                    symbols.append((entry[value_at], (info >> 4) != 1, entry[size_at], strings_size + entry[name_at], shndx))  # globals go first
+            strings_size += table[5]
+        elf.strings = b''.join(strings)
+        symbols.sort()
+        for (value, _, size, name, shndx) in symbols:
+            if elf.starts and elf.starts[-1] == value:  # aliases
+                continue
+            if not size:  # up to the next function or the end of its section
+                size = sections[shndx][3] + sections[shndx][5] - value
+            if elf.starts and elf.ends[-1] > value:
+                elf.ends[-1] = value
+            elf.starts.append(value)
+            elf.ends.append(value + size)
+            elf.names.append(name)
+        return elf
+
+    @staticmethod
+    def get_build_id(buffer, order, pos, end):
+        while pos + 12 <= end:
+            (namesz, descsz, type) = struct.unpack_from(order + 'III', buffer, pos)
+            pos += 12
+            name = buffer[pos:pos + namesz]
+            pos += (namesz + 3) & ~3
+            if type == 3 and name == b'GNU\0':  # NT_GNU_BUILD_ID
+                return binascii.hexlify(buffer[pos:pos + descsz]).decode()
+            pos += (descsz + 3) & ~3
+        return None
+
+    def get_address(self, load_addr, ptr):
+        return ptr - load_addr + self.base
+
+    def resolve(self, addr):  # returns mangled name or None
+        index = bisect.bisect_right(self.starts, addr) - 1
+        if index < 0 or addr >= self.ends[index]:
+            return None
+        start = self.names[index]
+        return self.strings[start:self.strings.find(b'\0', start)].decode('utf-8', 'replace')
+
+
+ElfFiles = shared_global('ElfFiles', {})  # module path -> ElfSymbols or None
+SymbolizerLock = shared_global('SymbolizerLock', threading.RLock())  # guards the registries of symbolizers, prefetch_symbols resolves modules in threads
+
+
+def get_elf_symbols(path):
+    with SymbolizerLock:
+        if path not in ElfFiles:
+            try:
+                ElfFiles[path] = ElfSymbols.parse(path)
+            except EnvironmentError:
+                ElfFiles[path] = None
+        return ElfFiles[path]
+
+
+class CxxFilt:
+    """Long-lived c++filt, it answers a line to every line of mangled name."""
+    Chunk = 0x8000  # bytes written at once, stdin pipe holds them while c++filt is blocked on stdout
+
+    def __init__(self):
+        self.proc = subprocess.Popen(['c++filt'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=get_symbolizer_env())
+        SymbolizerStats.add('c++filt', processes=1)
+        self.lock = threading.Lock()
+
+    def demangle(self, names):  # returns {mangled: demangled}
+        result = {}
+        pos = 0
+        with self.lock:
+            while pos < len(names):
+                (chunk, size) = ([], 0)
+                while pos < len(names) and (not chunk or size + len(names[pos]) < self.Chunk):
+                    chunk.append(names[pos])
+                    size += len(names[pos]) + 1
+                    pos += 1
+                self.proc.stdin.write(('\n'.join(chunk) + '\n').encode())
+                self.proc.stdin.flush()
+                for name in chunk:
+                    line = self.proc.stdout.readline()
+                    if not line:
+                        raise IOError('c++filt has exited')
+                    result[name] = line.decode('utf-8', 'replace').rstrip('\r\n')
+        return result
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait()
+        except EnvironmentError:
+            pass
+
+
+Demangled = shared_global('Demangled', {})  # mangled -> demangled name
+CxxFilts = shared_global('CxxFilts', [])  # the CxxFilt, None if it failed
+
+
+def demangle(names):  # returns {mangled: demangled}, names stay mangled without c++filt
+    mangled = sorted(set(name for name in names if name and name.startswith('_Z') and name not in Demangled))
+    if not mangled:
+        return Demangled
+    with SymbolizerLock:
+        if CxxFilts == [None]:
+            return Demangled
+        try:
+            if not CxxFilts:
+                CxxFilts.append(CxxFilt())
+            Demangled.update(CxxFilts[0].demangle(mangled))
+        except EnvironmentError:
+            message('warning', 'c++filt failed, names stay mangled')
+            if CxxFilts[0]:
+                CxxFilts[0].close()
+            CxxFilts[:] = [None]
+    return Demangled
+
+
+def resolve_linux(args, path, load_addr, ptrs):  # returns {ptr: resolve_cmd output}
+    elf = get_elf_symbols(path)
+    if not elf:  # not ELF, addr2line gets the pointers as they are
+        return get_addr2line(args, path).resolve(ptrs)
+    addrs = dict((elf.get_address(load_addr, ptr), ptr) for ptr in ptrs)
+    if args.elf_symbols:
+        names = dict((addr, elf.resolve(addr)) for addr in addrs)
+        demangled = demangle(names.values())
+        return dict((addrs[addr], demangled.get(name, name) or '') for addr, name in names.items())
+    return dict((addrs[addr], symbol) for addr, symbol in get_addr2line(args, path).resolve(sorted(addrs)).items())
+
+
+def get_symbolizer_env():
+    env = dict(os.environ)
+    if "INTEL_SEA_VERBOSE" in env:
+        del env["INTEL_SEA_VERBOSE"]
+    return env
+
+
+class Addr2Line:
+    """
+    Long-lived addr2line of one module, addresses go to its stdin and the answers come back from stdout.
+    With -a every answer starts with the address, ' (inlined by)' lines continue it.
+    """
+    Batch = 1024  # addresses written at once, keeps stdin pipe from filling while addr2line is blocked on stdout
+    Sentinel = '0\n'  # closes each batch: the answer to it tells that all answers before it are complete
+    Inlined = ' (inlined by)'
+
+    def __init__(self, path):
+        with open(os.devnull, 'w') as devnull:
+            self.proc = subprocess.Popen(['addr2line', '-a', '-e', path, '-i', '-p', '-f', '-C'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull, env=get_symbolizer_env())
+        SymbolizerStats.add(path, processes=1)
+
+    def resolve(self, ptrs):  # returns {ptr: text the way 'addr2line ptr -e path -i -p -f -C' prints it}
+        results = {}
+        for start in range(0, len(ptrs), self.Batch):
+            batch = ptrs[start:start + self.Batch]
+            self.proc.stdin.write((''.join('%x\n' % ptr for ptr in batch) + self.Sentinel).encode())
+            self.proc.stdin.flush()
+            index = -1  # lines left from the previous sentinel are dropped
+            lines = []
+            while True:
+                line = self.proc.stdout.readline()
+                if not line:
+                    raise IOError('addr2line has exited')
+                line = line.decode('utf-8', 'replace')
+                if line.startswith(self.Inlined):
+                    if index >= 0:
+                        lines.append(line)
+                    continue
+                if lines:
+                    results[batch[index]] = ''.join(lines)
+                index += 1
+                if index == len(batch):  # the sentinel
+                    break
+                lines = [line.split(': ', 1)[-1]]
+        return results
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait()
+        except (IOError, OSError):
+            pass
+
+
+class Addr2LinePool:
+    """Up to 'workers' addr2line processes of one module, big requests are split among them and resolved in threads."""
+    Part = 4 * Addr2Line.Batch  # less is not worth loading debug info by one more process
+
+    def __init__(self, path, workers):
+        self.path = path
+        self.workers = max(1, workers)
+        self.procs = []
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.idle.empty() and len(self.procs) < self.workers:
+                proc = Addr2Line(self.path)
+                self.procs.append(proc)
+                return proc
+        return self.idle.get()
+
+    def release(self, proc, failed=False):
+        if not failed:
+            return self.idle.put(proc)
+        proc.close()
+        with self.lock:
+            self.procs.remove(proc)
+
+    def resolve_part(self, ptrs, results):
+        try:
+            proc = self.acquire()
+        except (IOError, OSError):
+            print("Failed to start addr2line for", self.path)
+            print(traceback.format_exc())
+            return
+        try:
+            results.update(proc.resolve(ptrs))
+        except (IOError, OSError):
+            print("addr2line failed on", self.path)
+            return self.release(proc, True)
+        self.release(proc)
+
+    def resolve(self, ptrs):
+        results = {}
+        count = min(self.workers, len(ptrs) // self.Part)
+        if count < 2:
+            self.resolve_part(ptrs, results)
+            return results
+        step = (len(ptrs) + count - 1) // count  # sorted slices keep addr2line lookups local
+        threads = [threading.Thread(target=self.resolve_part, args=(ptrs[i:i + step], results)) for i in range(0, len(ptrs), step)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def close(self):
+        with self.lock:
+            for proc in self.procs:
+                proc.close()
+            self.procs = []
+            self.idle = queue.Queue()
+
+
+Addr2LinePools = shared_global('Addr2LinePools', {})  # module path -> Addr2LinePool, lives until exit
+
+
+def get_symbolizer_count(args):
+    import multiprocessing
+    return args.symbolizers or min(4, multiprocessing.cpu_count())
+
+
+def get_addr2line(args, path):
+    with SymbolizerLock:
+        if path not in Addr2LinePools:
+            Addr2LinePools[path] = Addr2LinePool(path, get_symbolizer_count(args))
+        return Addr2LinePools[path]
+
+
+class SymbolCache:
+    """
+    Symbolizer answers kept between runs in sqlite next to PermanentCache: (module, offset) -> text.
+    Module is its path, size and mtime, so rebuilt binaries miss and their old rows age out.
+    Every row remembers the run that used it last, the least recently used are evicted beyond the limit.
+    """
+
+    def __init__(self, path, limit):
+        import sqlite3
+        self.limit = limit
+        self.stamp = int(time.time())
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)  # jobs of run_jobs share it
+        self.conn.execute('CREATE TABLE IF NOT EXISTS symbols (module TEXT, offset INTEGER, symbol TEXT, used INTEGER, PRIMARY KEY (module, offset))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS lru ON symbols (used)')
+        self.modules = {}  # module -> {offset: symbol}, read on first use
+        self.used = {}  # module -> offsets hit in this run
+        self.new = []  # rows to write on close
+        self.lock = threading.Lock()
+
+    def get_module(self, module):
+        with self.lock:
+            if module not in self.modules:
+                self.modules[module] = dict(self.conn.execute('SELECT offset, symbol FROM symbols WHERE module=?', (module,)))
+        return self.modules[module]
+
+    def lookup(self, module, offsets):  # returns {offset: symbol} of the cached offsets
+        symbols = self.get_module(module)
+        found = dict((offset, symbols[offset]) for offset in offsets if offset in symbols)
+        with self.lock:
+            self.used.setdefault(module, set()).update(found)
+        return found
+
+    def store(self, module, symbols):
+        self.get_module(module).update(symbols)
+        with self.lock:
+            self.new += [(module, offset, symbol, self.stamp) for offset, symbol in symbols.items()]
+
+    def close(self):
+        try:
+            with self.conn:
+                self.conn.executemany('INSERT OR REPLACE INTO symbols VALUES(?,?,?,?)', self.new)
+                for module, offsets in self.used.items():
+                    self.conn.executemany('UPDATE symbols SET used=? WHERE module=? AND offset=?', [(self.stamp, module, offset) for offset in offsets])
+                (count,) = self.conn.execute('SELECT COUNT(*) FROM symbols').fetchone()
+                if count > self.limit:
+                    self.conn.execute('DELETE FROM symbols WHERE rowid IN (SELECT rowid FROM symbols ORDER BY used LIMIT ?)', (count - self.limit,))
+        except Exception as exc:
+            message('warning', 'Failed to save symbol cache: %s' % exc)
+        self.conn.close()
+
+
+SymbolCaches = shared_global('SymbolCaches', {})  # SymbolCachePath -> SymbolCache, None if it failed to open
+
+
+def get_symbol_cache(args):
+    if not args.symbol_cache:
+        return None
+    with SymbolizerLock:
+        if SymbolCachePath not in SymbolCaches:
+            try:
+                SymbolCaches[SymbolCachePath] = SymbolCache(SymbolCachePath, args.symbol_cache)
+            except Exception as exc:
+                message('warning', 'Failed to open symbol cache: %s' % exc)
+                SymbolCaches[SymbolCachePath] = None
+        return SymbolCaches[SymbolCachePath]
+
+
+class SymbolStore:
+    """
+    Local copies of the modules of remote targets, symbol server style: <store>/<name>/<key>/<name>.
+    The key is GNU build-id of ELF module, or its size and path hash otherwise, modules.idx maps target path and size to it.
+    It is filled once by pull over Remote.copy, then the traces of the target symbolize offline on any machine.
+    """
+    Index = 'modules.idx'
+
+    def __init__(self, path):
+        self.path = path
+        self.modules = {}  # (target path, size) -> key
+        index = os.path.join(path, self.Index)
+        if os.path.exists(index):
+            with open(index) as file:
+                for line in file:
+                    (size, key, module) = line.rstrip('\n').split(' ', 2)
+                    self.modules[(module, int(size))] = key
+
+    def get_file(self, module, key):
+        name = os.path.basename(module)
+        return os.path.join(self.path, name, key, name)
+
+    def find(self, module, size):  # returns the local copy of the target module or None
+        key = self.modules.get((module, int(size)))
+        return self.get_file(module, key) if key else None
+
+    def add(self, module, size, local):  # moves the local copy of the target module into the store
+        import hashlib
+        try:
+            elf = ElfSymbols.parse(local)  # None for what is not ELF, as Mach-O of a darwin target
+            build_id = elf.build_id if elf else None
+        except EnvironmentError:
+            build_id = None
+        key = build_id or '%x-%s' % (size, hashlib.md5(module.encode()).hexdigest()[:16])
+        target = self.get_file(module, key)
+        if not os.path.exists(target):  # the same build might come by the other path
+            if not os.path.exists(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            shutil.move(local, target)
+        self.modules[(module, size)] = key
+        with open(os.path.join(self.path, self.Index), 'a') as file:
+            file.write('%d %s %s\n' % (size, key, module))
+        return target
+
+    def pull(self, remote, args, modules):  # modules: {target path: size}, copies those the store misses
+        temp = tempfile.mkdtemp()
+        try:
+            for module, size in sorted(modules.items()):
+                size = int(size)
+                if not size or self.find(module, size):  # Fn2Mdl writes size 0 but for .so, ModuleIndex maps no pointer into those
+                    continue
+                local = os.path.join(temp, os.path.basename(module))
+                try:
+                    remote.copy('%s:%s' % (args.ssh, module), local)
+                except Exception as exc:
+                    message('warning', 'Failed to pull %s: %s' % (module, exc))
+                    continue
+                if os.path.getsize(local) != size:
+                    message('warning', '%s has changed since the capture, not stored' % module)
+                    continue
+                self.add(module, size, local)
+        finally:
+            shutil.rmtree(temp)
+
+
+SymbolStores = shared_global('SymbolStores', {})  # --symbol_store -> SymbolStore
+
+
+def get_symbol_store(args):
+    if not args.symbol_store:
+        return None
+    with SymbolizerLock:
+        if args.symbol_store not in SymbolStores:
+            if not os.path.exists(args.symbol_store):
+                os.makedirs(args.symbol_store)
+            SymbolStores[args.symbol_store] = SymbolStore(args.symbol_store)
+        return SymbolStores[args.symbol_store]
+
+
+def get_module_key(args, path, load_addr):
+    stat = os.stat(path)
+    key = '%s|%d|%d' % (path, stat.st_size, int(stat.st_mtime))
+    if 'linux' in sys.platform:
+        if not get_elf_symbols(path):  # addr2line gets absolute pointers, its answers hold for this load address only
+            key += '@%x' % load_addr
+        elif args.elf_symbols:  # names without file:line
+            key += '#elf'
+    return key
+
+
+class SymbolStats:
+    """
+    Counters of the resolver chain: ResolvedPointers in memory, JIT maps, SymbolCache on disk and the symbolizer processes.
+    Modules are counted by the path of the file they are symbolized by, c++filt is the module of its own.
+    """
+    Counters = ('pointers', 'disk_hits', 'misses', 'processes', 'seconds')  # misses went to the symbolizer, seconds it took
+
+    def __init__(self):
+        self.lock = threading.Lock()  # prefetch_symbols resolves modules in threads
+        self.memory = 0  # these three are counted in the merge thread only
+        self.jit = 0
+        self.unknown = 0  # out of modules or no file to symbolize the module by
+        self.modules = {}  # module -> {counter: value}
+
+    def add(self, module, **counters):
+        with self.lock:
+            stats = self.modules.setdefault(module, dict.fromkeys(self.Counters, 0))
+            for name, value in counters.items():
+                stats[name] += value
+
+    def get_data(self):
+        with self.lock:
+            return {'memory_hits': self.memory, 'jit_hits': self.jit, 'unknown': self.unknown, 'modules': copy.deepcopy(self.modules)}
+
+    def pop(self):
+        data = self.get_data()
+        self.__init__()
+        return data
+
+    def merge(self, data):
+        self.memory += data['memory_hits']
+        self.jit += data['jit_hits']
+        self.unknown += data['unknown']
+        for module, counters in data['modules'].items():
+            self.add(module, **counters)
+
+    def report(self, args):
+        data = self.pop()
+        if not any([data['memory_hits'], data['jit_hits'], data['unknown'], data['modules']]):
+            return
+        lines = ['Symbolization: %(memory_hits)d memory cache hits, %(jit_hits)d JIT hits, %(unknown)d pointers out of known modules' % data]
+        lines.append('%10s %10s %10s %10s %10s  %s' % ('pointers', 'disk hits', 'misses', 'processes', 'seconds', 'module'))
+        for module, stats in sorted(data['modules'].items(), key=lambda item: item[1]['seconds'], reverse=True):
+            lines.append('%(pointers)10d %(disk_hits)10d %(misses)10d %(processes)10d %(seconds)10.3f' % stats + '  ' + module)
+        Collector.log('\n'.join(lines))
+        if args and args.symbol_stats:
+            with open(args.symbol_stats, 'w') as file:
+                json.dump(data, file, indent=2, sort_keys=True)
+
+
+SymbolizerStats = shared_global('SymbolizerStats', SymbolStats())
+
+
+@atexit.register
+def close_symbolizers(report=True):  # pool workers of run_jobs skip atexit, job_worker calls it
+    for pool in Addr2LinePools.values():
+        pool.close()
+    Addr2LinePools.clear()
+    for cache in SymbolCaches.values():
+        if cache:
+            cache.close()
+    SymbolCaches.clear()
+    for cxx_filt in CxxFilts:
+        if cxx_filt:
+            cxx_filt.close()
+    del CxxFilts[:]
+    if report:
+        SymbolizerStats.report(get_args())
+
+
+def resolve_cmd_batch(args, path, load_addr, ptrs):  # returns {ptr: resolve_cmd output}
+    ptrs = sorted(set(ptrs))
+    result = {}
+    cache = get_symbol_cache(args)
+    if cache:
+        module = get_module_key(args, path, load_addr)
+        for offset, symbol in cache.lookup(module, [ptr - load_addr for ptr in ptrs]).items():
+            result[load_addr + offset] = symbol
+        SymbolizerStats.add(path, pointers=len(ptrs), disk_hits=len(result))
+        ptrs = [ptr for ptr in ptrs if ptr not in result]
+    else:
+        SymbolizerStats.add(path, pointers=len(ptrs))
+    if not ptrs:
+        return result
+    start = time.time()
+    if 'linux' in sys.platform:
+        resolved = resolve_linux(args, path, load_addr, ptrs)
+    else:
+        resolved = dict((ptr, resolve_cmd(args, path, load_addr, ptr)) for ptr in ptrs)
+    SymbolizerStats.add(path, misses=len(ptrs), seconds=time.time() - start)
+    if cache:
+        cache.store(module, dict((ptr - load_addr, symbol) for ptr, symbol in resolved.items()))
+    result.update(resolved)
+    return result
+
+
 def resolve_cmd(args, path, load_addr, ptr, cache={}):
     if sys.platform == 'win32':
         if path.startswith('\\'):
@@ -2345,16 +4136,15 @@ def resolve_cmd(args, path, load_addr, ptr, cache={}):
     elif sys.platform == 'darwin':
         cmd = 'atos -o "%s" -l %s %s' % (path, to_hex(load_addr), to_hex(ptr))
     elif 'linux' in sys.platform:
-        cmd = 'addr2line %s -e "%s" -i -p -f -C' % (to_hex(ptr), path)
+        return resolve_linux(args, path, load_addr, [ptr]).get(ptr, '')
     else:
         assert (not "Unsupported platform!")
 
-    env = dict(os.environ)
-    if "INTEL_SEA_VERBOSE" in env:
-        del env["INTEL_SEA_VERBOSE"]
+    env = get_symbolizer_env()
 
     try:
         proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        SymbolizerStats.add(path, processes=1)
         (symbol, err) = proc.communicate()
     except IOError:
         err = traceback.format_exc()
@@ -2392,71 +4182,199 @@ def resolve_jit(tree, ptr, cache):
         return False
     jit = tree['jit']
     if jit['start'] <= ptr <= jit['end']:
-        jit_data = jit['data']
-        idx = bisect_right(jit_data, ptr, lambda item: item['addr']) - 1
-        if idx > -1:
-            offset = ptr - jit_data[idx]['addr']
-            if offset > jit_data[idx]['size']:
-                return False
-            cache[ptr] = {'module': 'jit'}
-            cache[ptr]['str'] = jit_data[idx]['name']
-            if not cache[ptr]['str']:
-                cache[ptr]['str'] = 'jit_method_%d' % jit_data[idx]['id']
-            cache[ptr]['__file__'] = jit_data[idx]['file']
-            lines = jit_data[idx]['lines']
-            idx = bisect_right(lines, offset, lambda item: item[0]) - 1
-            if idx > -1:
-                cache[ptr]['__line__'] = lines[idx][1]
+        symbol = jit['map'].resolve(ptr)
+        if not symbol:
+            return False
+        cache[ptr] = symbol
+        SymbolizerStats.jit += 1
         return True
     else:
         return False
 
 
-def resolve_pointer(args, tree, ptr, call, cache={}):
-    if ptr not in cache:
-        if not resolve_jit(tree, ptr, cache):
-            (load_addr, path) = get_module_by_ptr(tree, ptr)
-            if path is None or not os.path.exists(path):
-                cache[ptr] = None
-            else:
-                symbol = resolve_cmd(args, path, load_addr, ptr)
-                cache[ptr] = {'module': path}
-                lines = symbol.splitlines()
-                if lines:
-                    if sys.platform == 'win32':
-                        if len(lines) == 1:
-                            cache[ptr]['str'] = lines[0]
-                        elif len(lines) == 2:
-                            cache[ptr]['str'] = lines[1]
-                            (cache[ptr]['__file__'], cache[ptr]['__line__']) = lines[0].rstrip(")").rsplit("(", 1)
-                    elif sys.platform == 'darwin':
-                        if '(in' in lines[0]:
-                            parts = lines[0].split(" (in ")
-                            cache[ptr]['str'] = parts[0]
-                            if ') (' in parts[1]:
-                                (cache[ptr]['__file__'], cache[ptr]['__line__']) = parts[1].split(') (')[1].split(':')
-                                cache[ptr]['__line__'] = cache[ptr]['__line__'].strip(')')
-                    else:
-                        if ' at ' in lines[0]:
-                            (cache[ptr]['str'], fileline) = lines[0].split(' at ')
-                            (cache[ptr]['__file__'], cache[ptr]['__line__']) = fileline.strip().split(':')
+def parse_symbol(args, path, symbol):  # resolve_cmd output -> symbol of resolve_pointer
+    result = {'module': path}
+    lines = symbol.splitlines()
+    if lines:
+        if sys.platform == 'win32':
+            if len(lines) == 1:
+                result['str'] = lines[0]
+            elif len(lines) == 2:
+                result['str'] = lines[1]
+                (result['__file__'], result['__line__']) = lines[0].rstrip(")").rsplit("(", 1)
+        elif sys.platform == 'darwin':
+            if '(in' in lines[0]:
+                parts = lines[0].split(" (in ")
+                result['str'] = parts[0]
+                if ') (' in parts[1]:
+                    (result['__file__'], result['__line__']) = parts[1].split(') (')[1].split(':')
+                    result['__line__'] = result['__line__'].strip(')')
+        else:
+            if ' at ' in lines[0]:
+                (result['str'], fileline) = lines[0].split(' at ')
+                (result['__file__'], result['__line__']) = fileline.strip().split(':')
+            elif args.elf_symbols:  # just the name
+                result['str'] = lines[0]
+    return result
+
+
+ResolvedPointers = shared_global('ResolvedPointers', {})  # ptr -> symbol or None, the cache of resolve_pointer
+
+
+def resolve_pointer(args, tree, ptr, call, cache=ResolvedPointers):
+    if ptr in cache:
+        SymbolizerStats.memory += 1
+    elif not resolve_jit(tree, ptr, cache):
+        modules = get_module_index(tree)
+        (load_addr, path) = modules.find(ptr)
+        local = modules.locate(path, get_symbol_store(args)) if path else None
+        if local is None:
+            SymbolizerStats.unknown += 1
+            cache[ptr] = None
+        else:
+            cache[ptr] = parse_symbol(args, path, resolve_cmd_batch(args, local, load_addr, [ptr]).get(ptr, ''))
     if not cache[ptr] or 'str' not in cache[ptr]:
         return False
     call.update(cache[ptr])
     return True
 
 
-def resolve_stack(args, tree, data):
-    if tree['process']['bits'] == 64:
-        frames = struct.unpack('Q' * (len(data) / 8), data)
+def prefetch_symbols(args, tree, ptrs, cache=ResolvedPointers):  # resolves the pointers into the cache of resolve_pointer, modules go in parallel
+    modules = get_module_index(tree)
+    store = get_symbol_store(args)
+    by_module = {}
+    for ptr in ptrs:
+        if ptr in cache or resolve_jit(tree, ptr, cache):
+            continue
+        (load_addr, path) = modules.find(ptr)
+        local = modules.locate(path, store) if path else None
+        if local is None:
+            SymbolizerStats.unknown += 1
+            cache[ptr] = None
+        else:
+            by_module.setdefault((load_addr, path, local), []).append(ptr)
+    jobs = queue.Queue()
+    for job in by_module.items():
+        jobs.put(job)
+
+    def worker():
+        while True:
+            try:
+                ((load_addr, path, local), module_ptrs) = jobs.get_nowait()
+            except queue.Empty:
+                return
+            symbols = resolve_cmd_batch(args, local, load_addr, module_ptrs)
+            for ptr in module_ptrs:
+                cache[ptr] = parse_symbol(args, path, symbols.get(ptr, ''))
+
+    if len(by_module) < 2:  # single module of a stack doesn't need the threads
+        worker()
     else:
-        frames = struct.unpack('I' * (len(data) / 4), data)
-    stack = []
-    for frame in frames:
-        res = {'ptr': frame}
-        if resolve_pointer(args, tree, frame, res):
-            stack.append(res)
-    return stack
+        threads = [threading.Thread(target=worker) for _ in range(min(len(by_module), get_symbolizer_count(args)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return sum(len(module_ptrs) for module_ptrs in by_module.values())
+
+
+class DeferredSymbols:
+    """
+    Pointers an exporter kept with --defer_symbols, they are resolved in one batch on its finish.
+    Until then the pointer is named by its placeholder, the way get_name names the unresolved ones.
+    """
+
+    def __init__(self, args, tree):
+        self.args = args
+        self.tree = tree
+        self.pointers = set()
+
+    def add(self, ptr):
+        self.pointers.add(ptr)
+
+    @staticmethod
+    def get_placeholder(ptr):
+        return "func<" + to_hex(ptr) + ">"
+
+    def resolve(self, extra=()):  # returns {ptr: symbol} of the resolved ones among added and extra pointers
+        ptrs = self.pointers.union(extra)
+        prefetch_symbols(self.args, self.tree, ptrs)
+        return dict((ptr, ResolvedPointers[ptr]) for ptr in ptrs if ResolvedPointers.get(ptr) and 'str' in ResolvedPointers[ptr])
+
+
+class StackTable:
+    """
+    Interned stacks: unique frames and the prefix trie of them growing from the outermost caller.
+    A stack is the id of its innermost node, so each unique stack is stored once and samples just refer to it.
+    """
+
+    def __init__(self):
+        self.frame_ids = {}  # (ptr, str, module) -> frame id
+        self.frames = []  # frame id -> frame
+        self.nodes = {}  # (parent node, frame id) -> node
+        self.parents = array('q')  # node -> parent node, -1 for the outermost frame
+        self.node_frames = array('Q')  # node -> frame id
+
+    def add_frame(self, frame):
+        key = (frame['ptr'], frame.get('str'), frame.get('module'))
+        frame_id = self.frame_ids.get(key)
+        if frame_id is None:
+            frame_id = self.frame_ids[key] = len(self.frames)
+            self.frames.append(frame)
+        return frame_id
+
+    def add(self, stack):  # stack goes from the innermost frame, returns its id, -1 for the empty one
+        node = -1
+        for frame in reversed(stack):
+            key = (node, self.add_frame(frame))
+            child = self.nodes.get(key)
+            if child is None:
+                child = self.nodes[key] = len(self.parents)
+                self.parents.append(node)
+                self.node_frames.append(key[1])
+            node = child
+        return node
+
+    def get_frame(self, node):
+        return self.frames[self.node_frames[node]]
+
+    def get_parent(self, node):
+        return self.parents[node]
+
+    def get_stack(self, node):  # innermost frame first
+        stack = []
+        while node >= 0:
+            stack.append(self.frames[self.node_frames[node]])
+            node = self.parents[node]
+        return stack
+
+
+def get_stack_table(tree):  # shared by Callbacks and exporters of the tree
+    stacks = tree.get('stacks')
+    if stacks is None:
+        stacks = tree['stacks'] = StackTable()
+    return stacks
+
+
+def decode_stack(tree, data):  # stack blob of --stacks -> frame pointers, innermost first
+    frame = 'Q' if tree['process']['bits'] == 64 else 'I'
+    size = struct.calcsize(frame)
+    if not isinstance(data, (bytes, bytearray, memoryview)) or not len(data) or len(data) % size:
+        return ()
+    if hasattr(memoryview, 'cast'):  # the view of the blob, nothing is copied
+        return memoryview(data).cast('B').cast(frame)
+    return struct.unpack('%d%s' % (len(data) // size, frame), bytes(data))
+
+
+def resolve_stack(args, tree, data, cache=ResolvedPointers):
+    frames = decode_stack(tree, data)
+    if args.defer_symbols:  # the exporter resolves the frames it keeps, see DeferredSymbols
+        return [{'ptr': ptr} for ptr in frames]
+    missing = [ptr for ptr in frames if ptr not in cache]
+    SymbolizerStats.memory += len(frames) - len(missing)
+    if missing:  # all frames of the stack at once, see prefetch_symbols
+        prefetch_symbols(args, tree, set(missing), cache)
+    return [dict(symbol, ptr=ptr) for (ptr, symbol) in zip(frames, map(cache.get, frames)) if symbol and 'str' in symbol]
 
 
 def attachme():
@@ -2576,6 +4494,9 @@ class TaskCombiner:
     def handle_stack(self, task, stack, name='stack'):
         pass
 
+    def handle_interned_stack(self, task, stack_id, stack, name='stack'):  # stack_id is the id of the stack in get_stack_table(tree)
+        self.handle_stack(task, stack, name)
+
     def context_switch(self, time, cpu, prev, next):
         """
         Called to process context switch events on CPU.
@@ -2603,7 +4524,7 @@ def get_name(begin):
     if 'str' in begin:
         return begin['str']
     elif 'pointer' in begin:
-        return "func<" + to_hex(begin['pointer']) + ">"
+        return DeferredSymbols.get_placeholder(begin['pointer'])
     else:
         return "<unknown>"
 
@@ -2617,34 +4538,82 @@ def get_filter_path():
     return filter
 
 
-def is_domain_enabled(domain, default=True):
-    domains = global_storage('sea.is_domain_enabled', {})
-    if not domains:
-        filter = get_filter_path()
+class DomainFilter(object):
+    """
+    Domains of the filter file, see get_filter_path: a line per domain, those commented out with '#' are disabled.
+    Lines with '*' or '?' are rules for the domains they match, as 'Kernel::*', the first matching one decides.
+    The exact names go before the rules, '[' is not a glob character: 'Queue[0]' is a name, 'Queue[*' a rule.
+    Every domain asked gets its verdict kept, so a lookup is one dict access and save writes them all for the next run.
+    """
+    Glob = frozenset('*?')
+
+    def __init__(self, path):
+        self.path = path
+        self.domains = {}  # name -> enabled, exact names of the file and the verdicts of the domains asked since
+        self.rules = []  # (pattern, enabled) in order of the file
+        self.listed = set()  # exact names of the file, saved back whatever the rules say
+
+    def load(self):
         try:
-            with open(filter) as file:
+            with open(self.path) as file:
                 for line in file:
                     enabled = not line.startswith('#')
                     name = line.strip(' #\n\r')
-                    domains[name] = enabled
+                    if not name:
+                        continue
+                    if self.Glob.intersection(name):
+                        self.rules.append((name, enabled))
+                    else:
+                        self.domains[name] = enabled
+                        self.listed.add(name)
                     if not enabled:
-                        message('warning', 'The domain "%s" is disabled in %s' % (name, filter))
+                        message('warning', 'The domain "%s" is disabled in %s' % (name, self.path))
         except IOError:
             pass
-    if domain not in domains:
-        domains[domain] = default
-    return domains[domain]
+        return self
 
+    def is_enabled(self, domain, default=True):
+        enabled = self.domains.get(domain)
+        if enabled is None:
+            enabled = self.domains[domain] = self.match(domain, default)
+        return enabled
 
-def save_domains():
-    domains = global_storage('sea.is_domain_enabled', {})
+    def match(self, domain, default):
+        for pattern, enabled in self.rules:
+            if fnmatch.fnmatchcase(domain, pattern.replace('[', '[[]')):
+                return enabled
+        return default
+
+    def merge(self, other):  # verdicts of a job worker, see merge_job_storage
+        for name, enabled in other.domains.items():
+            self.domains.setdefault(name, enabled)
+        self.listed.update(other.listed)
 
-    filter = get_filter_path()
-    print("Saving domains:", filter)
+    def save(self):
+        with open(self.path, 'w') as file:
+            for pattern, enabled in self.rules:
+                file.write('%s%s\n' % ('#' if not enabled else '', pattern))
+            for name, enabled in self.domains.items():
+                if name in self.listed or self.match(name, None) != enabled:  # the rules cover the rest
+                    file.write('%s%s\n' % ('#' if not enabled else '', name))
 
-    with open(filter, 'w') as file:
-        for key, value in domains.items():
-            file.write('%s%s\n' % ('#' if not value else '', key))
+
+def get_domain_filter():  # loaded once, one for __main__ and the sea_runtool imported by extensions
+    storage = global_storage(None)
+    domain_filter = storage.get('DomainFilter')
+    if domain_filter is None:
+        domain_filter = storage['DomainFilter'] = DomainFilter(get_filter_path()).load()
+    return domain_filter
+
+
+def is_domain_enabled(domain, default=True):  # per event code keeps get_domain_filter() instead, as Callbacks does
+    return get_domain_filter().is_enabled(domain, default)
+
+
+def save_domains():
+    domain_filter = get_domain_filter()
+    print("Saving domains:", domain_filter.path)
+    domain_filter.save()
 
 
 class GraphCombiner(TaskCombiner):
@@ -2778,8 +4747,8 @@ class Collector:
             log_name = datetime.now().strftime('sea_%Y_%m_%d__%H_%M_%S.log')
             if args:
                 log_path = subst_env_vars(args.output)
-                if os.path.isfile(log_path):
-                    log_path = os.path.dirname(log_path)
+                if os.path.isfile(log_path):  # a trace or .seapack
+                    log_path = os.path.dirname(os.path.abspath(log_path))
                 ensure_dir(log_path, False)
                 if 'tempfile' in statics:
                     statics['tempfile'].close()